@@ -17,11 +17,14 @@ import os
 import csv
 import json
 import time
+import socket
 import numpy
 import argparse
-from math import log10
 from datetime import datetime
-from configparser import SafeConfigParser
+
+import configstore
+import logaccess
+import odengine
 
 
 def main():
@@ -32,47 +35,253 @@ def main():
 	"""
 	args = command_line_arguments()
 	# Ensure config file exists and function specified, then read in config variables
-	if os.path.exists(args.config) and (args.schedule != args.chamber):
-		config = SafeConfigParser()
-		config.read(args.config)
-		controller = dict(config.items('controller'))
-		log = dict(config.items('log'))
-
-		# The log is organized for schedule and chamber respectively like so:
-		# [date, time, schedule, new setpoints for chambers, human time (hr), experiment time, current ODs]
-		# [date, time, chamber, new setpoints for chambers, human time (hr), experiment time, current ODs]
-		if args.schedule:
-			programlog = [datetime.now().strftime("%Y-%m-%d"), datetime.now().strftime("%H:%M"), 'schedule']
-		else:
-			programlog = [datetime.now().strftime("%Y-%m-%d"), datetime.now().strftime("%H:%M"), 'chamber']
-		# Read in current ODs and make sure config variables match command line arguments
-		human_time, machine_time, current_ods = read_ods(args, log)
-		programlog = programlog + [','.join(controller['setpoint'].split()), human_time, machine_time, ','.join(str(e) for e in current_ods)]
-		controller = update_config(args, config, controller)
-
-		# If blocklog doesn't exist, start dilution blocks and create
-		if not os.path.exists(log['blocklog']):
-			update_log(args, log, programlog)
+	if args.stream and args.odlog:
+		print('ERROR: --stream receives the ODs of the full log, it can not be used with --odlog.')
+	elif os.path.exists(args.config) and (args.schedule != args.chamber):
+		store = configstore.ConfigStore(args.config)
+		store.read()
+		controller = dict(store.sections['controller'])
+		log = dict(store.sections['log'])
+		if args.replay:
+			replay(args, controller, log)
+		# Make sure config variables match command line arguments
+		elif update_config(args, store, controller) is None:
+			pass
+		elif args.daemon:
+			try:
+				daemon(args, store, controller, log)
+			except KeyboardInterrupt:
+				pass
 		else:
-			blocklog_file = open(log['blocklog'], 'r')
-			prevlog = list(csv.reader(blocklog_file))[-1]
-			blocklog_file.close()
-
-			# Update controller and programlog if block interval elapsed
-			if args.schedule:
-				controller, programlog = check_blockinterval(current_ods, controller, programlog, prevlog)
-			# Update controller and programlog with new setpoints and chamber report when each chamber reaches their setpoint
-			else:
-				controller, programlog = compare_ods(current_ods, controller, programlog)
-			# Update config and log if setpoints have been changed
-			if not prevlog[3] == programlog[3]:
-				update_config(args, config, controller)
-				update_log(args, log, programlog)
+			# Read in current ODs and take one step of the blocks
+			human_time, machine_time, current_ods = read_ods(args, log)
+			block_step(args, store, controller, log, read_prevlog(log), human_time, machine_time, current_ods)
 	else:
 		print('ERROR: Config file not found or function not specified correctly.')
 	print('Block-Dilutions.py end.')
 
 
+def block_step(args, store, controller, log, prevlog, human_time, machine_time, current_ods):
+	"""
+	Checks the current ODs against the blocks, updates the config and block log when the setpoints change.
+
+	:param args: command line arguments for program
+	:param store: config store the config variables were read from
+	:param controller: config file controller variables
+	:param log: config file log variables
+	:param prevlog: list of previous status (last line of the block log), None if there is no block log yet
+	:param human_time: experiment time in hours
+	:param machine_time: experiment time in machine units
+	:param current_ods: real ods from od log or full log file
+	:return: list of status after this step (the new last line of the block log)
+	"""
+	programlog = new_programlog(args, controller, datetime.now(), human_time, machine_time, current_ods)
+
+	# If blocklog doesn't exist, start dilution blocks and create
+	if prevlog is None:
+		update_log(args, log, programlog)
+		return programlog
+	controller, programlog = check_blocks(args, controller, programlog, prevlog, current_ods)
+	# Update config and log if setpoints have been changed
+	if not prevlog[3] == programlog[3]:
+		# Only transitions written to the config file are logged
+		if update_config(args, store, controller) is None:
+			return prevlog
+		update_log(args, log, programlog)
+		return programlog
+	return prevlog
+
+
+def new_programlog(args, controller, now, human_time, machine_time, current_ods):
+	"""
+	Starts the status of a block step, with the current setpoints.
+
+	:param args: command line arguments for program
+	:param controller: config file controller variables
+	:param now: date and time of the step
+	:param human_time: experiment time in hours
+	:param machine_time: experiment time in machine units
+	:param current_ods: real ods from od log or full log file
+	:return: list of status
+	"""
+	# The log is organized for schedule and chamber respectively like so:
+	# [date, time, schedule, new setpoints for chambers, human time (hr), experiment time, current ODs]
+	# [date, time, chamber, new setpoints for chambers, human time (hr), experiment time, current ODs]
+	if args.schedule:
+		programlog = [now.strftime("%Y-%m-%d"), now.strftime("%H:%M"), 'schedule']
+	else:
+		programlog = [now.strftime("%Y-%m-%d"), now.strftime("%H:%M"), 'chamber']
+	return programlog + [','.join(controller['setpoint'].split()), human_time, machine_time, ','.join(str(e) for e in current_ods)]
+
+
+def check_blocks(args, controller, programlog, prevlog, current_ods):
+	"""
+	Takes one step of the block state machine of the selected function.
+
+	:param args: command line arguments for program
+	:param controller: config file controller variables
+	:param programlog: list of updated status
+	:param prevlog: list of previous status
+	:param current_ods: real ods from od log or full log file
+	:return: updated controller and programlog
+	"""
+	# Update controller and programlog if block interval elapsed
+	if args.schedule:
+		return check_blockinterval(current_ods, controller, programlog, prevlog)
+	# Update controller and programlog with new setpoints and chamber report when each chamber reaches their setpoint
+	return compare_ods(current_ods, controller, programlog, float(args.tolerance))
+
+
+def replay(args, controller, log):
+	"""
+	Regenerates a block log offline from the whole od log or full log file in one pass, taking a block step at every
+	record (as the daemon does) from the saved setpoints at the start of the experiment. The config file is not changed.
+
+	:param args: command line arguments for program
+	:param controller: config file controller variables
+	:param log: config file log variables
+	"""
+	controller = dict(controller)
+	config_arguments(args, controller)
+	controller['setpoint'] = controller['savesetpoint']
+	prevlog, rows = None, []
+	for human_time, machine_time, current_ods in log_records(args, log):
+		programlog = new_programlog(args, controller, datetime.fromtimestamp(machine_time), human_time, machine_time, current_ods)
+		if prevlog is not None:
+			controller, programlog = check_blocks(args, controller, programlog, prevlog, current_ods)
+			if prevlog[3] == programlog[3]:
+				continue
+		rows.append(programlog)
+		prevlog = programlog
+	with open(args.replay, 'w') as replay_file:
+		csv.writer(replay_file).writerows(rows)
+	if args.out:
+		print('Block log of {} rows replayed to {}'.format(len(rows), args.replay))
+
+
+def log_records(args, log):
+	"""
+	Reads every complete record of the od log or full log file, the ods of the od log are computed all at once.
+
+	:param args: command line arguments for program
+	:param log: config file log variables
+	:return: generator of od values, experiment time in human (hr) and machine units, for every record
+	"""
+	if args.odlog:
+		btx, brx = odengine.read_blank(log['blanklog'])
+		timestamps, tx, rx = odengine.read_odlog(log['odlog'])
+		ods = odengine.compute_ods(btx, brx, tx, rx)
+		timestamps = timestamps.tolist()
+		for machine_time, current_ods in zip(timestamps, ods.tolist()):
+			yield float(machine_time - timestamps[0]) / 3600, machine_time, current_ods
+		return
+	time_start = None
+	with open(log['fulllog'], 'rb') as log_file:
+		for line in log_file:
+			# a record still being written is left out
+			if not line.endswith(b'\n') or not line.strip():
+				continue
+			record = json.loads(line.decode('utf-8'))
+			if time_start is None:
+				time_start = record['timestamp']
+			yield round(float(record['timestamp'] - time_start) / 3600, 4), record['timestamp'], list(record['ods'])
+
+
+def daemon(args, store, controller, log):
+	"""
+	Keeps running with the blocks in memory and takes a block step for every new record of the log,
+	instead of being started by crontab for every check.
+	The config file is read again only when it changes (e.g. edited by hand) and written only when setpoints change.
+
+	:param args: command line arguments for program
+	:param store: config store the config variables were read from
+	:param controller: config file controller variables
+	:param log: config file log variables
+	"""
+	prevlog = read_prevlog(log)
+	version, config_stat = store.version, file_stat(args.config)
+	records = stream_records(args, store, log) if args.stream else tail_records(args, log)
+	for human_time, machine_time, current_ods in records:
+		# Read the config file again if another process (or a person) changed it
+		if file_stat(args.config) != config_stat:
+			store.read()
+			controller = dict(store.sections['controller'])
+			version, config_stat = store.version, file_stat(args.config)
+		prevlog = block_step(args, store, controller, log, prevlog, human_time, machine_time, current_ods)
+		if store.version != version:
+			# Written by this step
+			version, config_stat = store.version, file_stat(args.config)
+
+
+def file_stat(path):
+	"""
+	Identifies the current contents of a file, a replaced file has a new inode even if its size and time are the same.
+
+	:param path: path to the file
+	:return: tuple of modification time, size and inode
+	"""
+	stat = os.stat(path)
+	return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+def tail_records(args, log):
+	"""
+	Follows the end of the od log or full log file, checking every --poll seconds if it has grown.
+
+	:param args: command line arguments for program
+	:param log: config file log variables
+	:return: generator of current od values, experiment time in human (hr) and machine units, for every new record
+	"""
+	path = log['odlog'] if args.odlog else log['fulllog']
+	size, machine_time = None, None
+	while True:
+		if os.path.exists(path) and os.path.getsize(path) != size:
+			size = os.path.getsize(path)
+			record = read_ods(args, log)
+			if record[1] != machine_time:
+				machine_time = record[1]
+				yield record
+		time.sleep(float(args.poll))
+
+
+def stream_records(args, store, log):
+	"""
+	Receives every new full log record from the controller's network port (or its Unix socket if one is configured),
+	reconnecting every --poll seconds while the controller is not running.
+
+	:param args: command line arguments for program
+	:param store: config store the config variables were read from
+	:param log: config file log variables
+	:return: generator of current od values, experiment time in human (hr) and machine units, for every new record
+	"""
+	ports = dict(store.sections['ports'])
+	while True:
+		try:
+			if ports.get('unixsocket', 'NONE').upper() != 'NONE':
+				connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+				connection.connect(ports['unixsocket'])
+			else:
+				connection = socket.create_connection(('localhost', int(ports['network'])))
+		except socket.error:
+			time.sleep(float(args.poll))
+			continue
+		# sockets and their files are not context managers in Python 2
+		lines = connection.makefile('rb')
+		try:
+			connection.sendall(b'stream\n')
+			for line in lines:
+				line = line.decode('utf-8').strip()
+				# the answer to the stream command and any other replies are not log records
+				if line.startswith('{'):
+					yield fulllog_ods(logaccess.first_line(log['fulllog']), line)
+		except socket.error:
+			pass
+		finally:
+			lines.close()
+			connection.close()
+		time.sleep(float(args.poll))
+
+
 def command_line_arguments():
 	"""
 	Takes in command line argument parameters and displays help descriptions.
@@ -88,6 +297,8 @@ def command_line_arguments():
 		Defaults to config.ini
 	Optional changes: --odlog, --delay, --config, 
 			--out (-o), --growth (-g), --dilution (-d)
+	Daemon mode (instead of crontab): --daemon, --poll, --stream
+	Offline: --replay regenerates the block log from the whole log
 				""")
 
 	parser.add_argument('--odlog', action='store_true', help='use OD log for OD input (instead of default full log)')
@@ -97,7 +308,14 @@ def command_line_arguments():
 	parser.add_argument('-g', '--growth', default='0', help='specify hour interval for growth block (default config, otherwise 7)')
 	parser.add_argument('-d', '--dilution', default='0', help='specify hour interval for dilution (default config, otherwise 4)')
 	parser.add_argument('-c', '--chamber', action='store_true', help='use individual chamber OD for dilutions')
+	parser.add_argument('--tolerance', default='0.05',
+						help='fraction of the set point within which a chamber has reached it (default 0.05 = 5%%)')
 	parser.add_argument('-s', '--schedule', action='store_true', help='use interval dilution schedule for dilutions')
+	parser.add_argument('--daemon', action='store_true', help='keep running and check every new log record (instead of crontab)')
+	parser.add_argument('--poll', default='5', help='seconds between checks of the log for new records in daemon mode (default 5)')
+	parser.add_argument('--stream', action='store_true',
+						help="in daemon mode receive the full log records from the controller's network port instead of the log file")
+	parser.add_argument('--replay', help='write the block log the whole log would produce to this csv (config file is not changed)')
 
 	args = parser.parse_args()
 	return args
@@ -106,6 +324,7 @@ def command_line_arguments():
 def read_ods(args, log):
 	"""
 	Read in current ods based on od log or full log file.
+	Only the first and last records of the log are read, so a run takes the same time however long the experiment is.
 
 	:param args: command line arguments for program
 	:param log: config file log variables
@@ -113,63 +332,86 @@ def read_ods(args, log):
 	"""
 	# if odlog specificed, compute compute ODs from blank and odlog file
 	if args.odlog:
-		blank_file = open(log['blanklog'], 'r')
-		blank_content = blank_file.read()
-		blank_file.close()
-		blank_data = list(map(int, blank_content.split()))
-		btx = blank_data[0::2]
-		brx = blank_data[1::2]
-
-		odlog_file = open(log['odlog'], 'r')
-		first = odlog_file.readlines()[0]
-		line = odlog_file.readlines()[-1]
-		odlog_file.close()
+		btx, brx = odengine.read_blank(log['blanklog'])
+
+		first = logaccess.first_line(log['odlog'])
+		line = logaccess.last_line(log['odlog'])
 
 		time_start = int(first.split()[0])
 		line = list(map(int, line.split()))
-		current_ods = []
 		machine_time = int(line[0])
 		human_time = float(machine_time - time_start) / 3600
-		tx = line[1::2]
-		rx = line[2::2]
-		for num in range(8):
-			if tx[num] == 0 or rx[num] == 0 or brx[num] == 0 or btx[num] == 0:
-				current_ods.append(0)
-				continue
-			blank_od = float(brx[num]) / float(btx[num])
-			od_measure = float(rx[num]) / float(tx[num])
-			current_ods.append(log10(blank_od/od_measure))
+		tx, rx = odengine.split_readings(line[1:])
+		current_ods = odengine.compute_ods(btx, brx, tx, rx).tolist()
 	# otherwise use json standard library to get ODs from fulllog file
 	else:
-		log_file = open(log['fulllog'], 'r')
-		log_data = log_file.readlines()
-		log_file.close()
-		first = log_data[0]
-		time_start = json.loads(first)['timestamp']
-		last_line = log_data[-1]
-		if len(last_line) < 1:
-			last_line = log_data[-2]
-		last_line = json.loads(last_line)
-		current_ods = list(last_line['ods'])
-		machine_time = last_line['timestamp']
-		human_time = round(float(machine_time - time_start) / 3600, 4)
+		human_time, machine_time, current_ods = fulllog_ods(logaccess.first_line(log['fulllog']), logaccess.last_line(log['fulllog']))
+	return human_time, machine_time, current_ods
+
+
+def fulllog_ods(first, last):
+	"""
+	Read in current ods from a record of the full log file.
+
+	:param first: first line of the full log file
+	:param last: full log record with the current ods
+	:return: list of current od values, experiment time in human (hr) and machine units
+	"""
+	time_start = json.loads(first)['timestamp']
+	last_line = json.loads(last)
+	current_ods = list(last_line['ods'])
+	machine_time = last_line['timestamp']
+	human_time = round(float(machine_time - time_start) / 3600, 4)
 	return human_time, machine_time, current_ods
 
 
-def update_config(args, config, controller):
+def read_prevlog(log):
+	"""
+	Read in the previous status, the last line of the block log.
+
+	:param log: config file log variables
+	:return: list of previous status, None if there is no block log yet
+	"""
+	if not os.path.exists(log['blocklog']):
+		return None
+	return next(csv.reader([logaccess.last_line(log['blocklog'])]))
+
+
+def update_config(args, store, controller):
 	"""
 	Updates the config file to match command line arguments and program updates.
+	The update is only written if no other process (e.g. the controller) changed the config file since it was read.
 
 	:param args: command line arguments for program
-	:param config: variable holding all config variables from file
+	:param store: config store the config variables were read from
 	:param controller: config file controller variables
-	:return: updated controller variables
+	:return: updated controller variables, None if the config file changed since it was read and was not updated
 	"""
-	# Save set points if they have not been saved before and delay program for specified time
+	delay = config_arguments(args, controller)
+	# Only write the config file when something changed, the controller reads it again after every write
+	changes = dict((key, str(value)) for key, value in controller.items() if str(value) != store.sections['controller'].get(key))
+	if changes and store.compareAndSwap(store.version, {'controller': changes}) is None:
+		# The next check starts over from the changed config file
+		print('Config file changed by another process, update not written.')
+		return None
+	if not delay <= 0:
+		time.sleep(delay*60)
+	return controller
+
+
+def config_arguments(args, controller):
+	"""
+	Makes the controller variables match command line arguments.
+
+	:param args: command line arguments for program
+	:param controller: config file controller variables, updated in place
+	:return: minutes to delay the first run by, 0 if this is not the first run
+	"""
+	# Save set points if they have not been saved before and delay program for specified time (once they are saved)
+	delay = 0.0
 	if len(controller['savesetpoint'].split()) < 1:
 		controller['savesetpoint'] = controller['setpoint']
-		if not float(args.delay) <= 0:
-			time.sleep(float(args.delay)*60)
+		delay = float(args.delay)
 	# If block interval, set to config otherwise 1 if not specified, save as float, and update config to match
 	if args.schedule:
 		if float(args.growth) <= 0 and len(controller['growthinterval']) == 0:
@@ -182,10 +424,7 @@ def update_config(args, config, controller):
 			args.dilution = float(controller['dilutioninterval'])
 		controller['growthinterval'] = args.growth
 		controller['dilutioninterval'] = args.dilution
-	config['controller'] = controller
-	config_update = open(args.config, 'w')
-	config.write(config_update)
-	return controller
+	return delay
 
 
 def check_blockinterval(current_ods, controller, programlog, prevlog):
@@ -200,18 +439,19 @@ def check_blockinterval(current_ods, controller, programlog, prevlog):
 	:return: updated controller and programlog
 	"""
 	diff = float(programlog[5]) - float(prevlog[5])
+	reference_ods, block_ods, save_ods = controller_arrays(controller)
 	# If block interval reached (elapsed time = diff between current time and last blocklog entry)
-	#	then update the controller setpoints appropriately
-	if controller['setpoint'] == controller['savesetpoint'] and diff/3600 >= float(controller['growthinterval']):
+	#	then update the controller setpoints appropriately, all chambers together
+	if numpy.array_equal(reference_ods, save_ods) and diff/3600 >= float(controller['growthinterval']):
 		controller['setpoint'] = controller['blockstart']
-	elif controller['setpoint'] == controller['blockstart'] and diff/3600 >= float(controller['dilutioninterval']):
+	elif numpy.array_equal(reference_ods, block_ods) and diff/3600 >= float(controller['dilutioninterval']):
 		controller['setpoint'] = controller['savesetpoint']
 	programlog[3] = ','.join(controller['setpoint'].split())
 	programlog[-1] = ','.join(str(e) for e in current_ods)
 	return controller, programlog
 
 
-def compare_ods(current_ods, controller, programlog):
+def compare_ods(current_ods, controller, programlog, tolerance=0.05):
 	"""
 	Compares the current ods with the set points.
 	Updates controller and programlog appropriately.
@@ -219,26 +459,48 @@ def compare_ods(current_ods, controller, programlog):
 	:param current_ods: real ods from od log or full log file
 	:param controller: controller parameters from config file
 	:param programlog: list of updated status
+	:param tolerance: fraction of the set point within which a chamber has reached it
 	:return: updated controller and programlog variables
 	"""
-	reference_ods = list(map(float, controller['setpoint'].split()))
-	block_ods = list(map(float, controller['blockstart'].split()))
-	save_ods = list(map(float, controller['savesetpoint'].split()))
-	for num in range(8):
-		# If setpoint has original values, check if ODs have reached up to within 5% of setpoint
-		if reference_ods[num] == save_ods[num] and current_ods[num] >= (reference_ods[num]-(reference_ods[num]*0.05)):
-			# Update setpoint OD with new setpoint
-			reference_ods[num] = block_ods[num]
-		# Otherwise setpoint has blockstart values, check if ODs have reached down to within 5% of setpoint
-		elif current_ods[num] <= (reference_ods[num]+(reference_ods[num]*0.05)):
-			# Update setpoint OD with new setpoint
-			reference_ods[num] = save_ods[num]
+	reference_ods, block_ods, save_ods = controller_arrays(controller)
+	reference_ods = chamber_transitions(numpy.asarray(current_ods, dtype=float), reference_ods, block_ods, save_ods, tolerance).tolist()
 	controller['setpoint'] = ' '.join(str(e) for e in reference_ods)
 	programlog[3] = ','.join(str(e) for e in reference_ods)
 	programlog[-1] = ','.join(str(e) for e in current_ods)
 	return controller, programlog
 
 
+def chamber_transitions(current_ods, reference_ods, block_ods, save_ods, tolerance):
+	"""
+	Block state machine of every chamber at once, for any number of chambers.
+	A chamber at its saved set point switches to its blockstart set point once its od has grown up to within tolerance
+	of the set point, any other chamber switches back to its saved set point once it is diluted down to within tolerance.
+
+	:param current_ods: array of current ods
+	:param reference_ods: array of current set points
+	:param block_ods: array of blockstart set points
+	:param save_ods: array of saved set points
+	:param tolerance: fraction of the set point within which a chamber has reached it
+	:return: array of new set points
+	"""
+	grown = (reference_ods == save_ods) & (current_ods >= (reference_ods - (reference_ods * tolerance)))
+	diluted = ~grown & (current_ods <= (reference_ods + (reference_ods * tolerance)))
+	return numpy.where(grown, block_ods, numpy.where(diluted, save_ods, reference_ods))
+
+
+def controller_arrays(controller):
+	"""
+	Reads the set points of every chamber from the controller variables.
+
+	:param controller: controller parameters from config file
+	:return: arrays of current, blockstart and saved set points
+	"""
+	arrays = [numpy.array(controller[key].split(), dtype=float) for key in ['setpoint', 'blockstart', 'savesetpoint']]
+	if not len(arrays[0]) == len(arrays[1]) == len(arrays[2]):
+		raise ValueError('setpoint, blockstart and savesetpoint need a value for every chamber')
+	return arrays
+
+
 def update_log(args, log, programlog):
 	"""
 	Updates the blocklog file with new updates and prints out if specified.
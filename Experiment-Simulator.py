@@ -18,6 +18,8 @@ from configparser import ConfigParser
 import time
 import json
 
+import logaccess
+
 
 def main():
 	"""
@@ -112,14 +114,8 @@ def produce_data(args, od_subtraction):
 		logfile.close()
 		od_subtraction = numpy.asarray([0.0] * 8)
 
-	# read in the log data and save the variables from the last line
-	logfile = open(log['fulllog'], 'r')  # open input file
-	logdata = logfile.readlines()
-	logfile.close()
-	last_line = logdata[-1]
-	if len(last_line) < 1:
-		last_line = logdata[-2]
-	last_line = json.loads(last_line)
+	# read in the last line of the log data (without reading the whole log) and save its variables
+	last_line = json.loads(logaccess.last_line(log['fulllog']))
 	timestamp = last_line['timestamp']
 	latest_OD = numpy.asarray(last_line['ods'])
 	try:
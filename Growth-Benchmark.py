@@ -0,0 +1,178 @@
+"""
+BACKGROUND
+
+	Benchmarks the growth rate calculations of Growth-Pipe.py
+	An open source feature contribution to the Klavins Lab Flexostat project
+		project found at https://github.com/Flexostat/Flexostat-interface
+
+INSTRUCTIONS
+
+	Run using Python 3 on the command line as such
+	$ python3 Growth-Benchmark.py -h
+
+	The full log is parsed, repeated --scale times end to end to make a long synthetic experiment,
+	and the growth rates are calculated with both the original row by row loops and the current
+	array based functions. Run times are printed and the exported csvs are checked to be identical.
+"""
+
+import importlib.util
+import argparse
+import warnings
+import tempfile
+import filecmp
+import pandas
+import numpy
+import time
+import os
+
+
+def main():
+	"""
+	Defines the command line arguments intaken by the program and runs the benchmark.
+	"""
+	args = command_line_parameters()
+	pipe = load_growth_pipe()
+	with tempfile.TemporaryDirectory() as directory:
+		paths = {name: os.path.join(directory, name + '.csv') for name in ['u', 'od']}
+		pipe.parse(args.log, paths)
+		for name in paths:
+			scale_csv(paths[name], args.scale)
+		rows = sum(1 for _ in open(paths['od']))
+		print('{} rows ({} x {})'.format(rows, args.scale, args.log))
+
+		cases = [
+			('u_growth', lambda out: legacy_u_growth(paths['u'], out, args.volume),
+				lambda out: pipe.u_growth(paths['u'], out, args.volume)),
+			('od_growth', lambda out: legacy_od_growth(paths['od'], out),
+				lambda out: pipe.od_growth(paths['od'], out))]
+		for name, legacy, current in cases:
+			legacy_out = os.path.join(directory, name + '_legacy.csv')
+			current_out = os.path.join(directory, name + '.csv')
+			legacy_time = best_time(legacy, legacy_out, args.repeat)
+			current_time = best_time(current, current_out, args.repeat)
+			identical = filecmp.cmp(legacy_out, current_out, shallow=False)
+			print('{:<10} legacy {:9.3f}s   current {:9.3f}s   speedup {:7.1f}x   identical output: {}'.format(
+				name, legacy_time, current_time, legacy_time / current_time, identical))
+	print('Growth-Benchmark.py end.\n')
+
+
+def command_line_parameters():
+	"""
+	Takes in command line arguments and parses them for use.
+
+	:return: parsed arguments
+	"""
+	parser = argparse.ArgumentParser(description='Benchmark the growth rate calculations of Growth-Pipe.py.')
+	parser.add_argument('--log', default=os.path.join('Data', '10-20-17', 'log_171020.dat'),
+						help="change full log from default 'Data/10-20-17/log_171020.dat'")
+	parser.add_argument('--scale', type=int, default=10, help='number of times the log is repeated, default 10')
+	parser.add_argument('--repeat', type=int, default=1, help='runs of each calculation, the best is kept, default 1')
+	parser.add_argument('--volume', default='10', help='change ml volume of turbidostat chambers from default 10ml')
+	return parser.parse_args()
+
+
+def load_growth_pipe():
+	"""
+	Imports Growth-Pipe.py as a module (its file name is not a valid module name).
+
+	:return: the Growth-Pipe module
+	"""
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Growth-Pipe.py')
+	spec = importlib.util.spec_from_file_location('growth_pipe', path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+
+def scale_csv(path, scale):
+	"""
+	Repeats a parsed csv end to end, shifting the time of each copy so time keeps increasing.
+
+	:param path: path to the parsed csv, overwritten
+	:param scale: number of copies
+	"""
+	df = pandas.read_csv(path, header=None)
+	times = df[0]
+	span = times.iloc[-1] - times.iloc[0] + int(numpy.median(numpy.diff(times)))
+	copies = []
+	for copy in range(scale):
+		shifted = df.copy()
+		shifted[0] = times + copy * span
+		copies.append(shifted)
+	pandas.concat(copies).to_csv(path, index=False, header=False)
+
+
+def best_time(function, output, repeat):
+	"""
+	Runs a function several times and keeps the fastest run.
+
+	:param function: function taking the output path
+	:param output: path for export
+	:param repeat: number of runs
+	:return: seconds of the fastest run
+	"""
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function(output)
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+
+def legacy_u_growth(intake, output, volume):
+	"""
+	The original row by row u_growth of Growth-Pipe.py, kept for comparison.
+
+	:param intake: path to data
+	:param output: path for export
+	:param volume: volume of the turbidostat growth chamber
+	"""
+	df = pandas.read_csv(intake, header=None, names=['Time',1,2,3,4,5,6,7,8])
+	new_data_r = []
+	time_start = df['Time'][0]
+	time_difference = 0
+	for row in range(1, df.shape[0]):
+		new_row = []
+		new_row.append(df['Time'][row] - time_start)
+		time_difference = df['Time'][row] - df['Time'][row - 1]
+		for chamber in range(1, 9):
+			if df[chamber][row] == 0:
+				new_row.append(float(0))
+			else:
+				new_row.append(round((numpy.log(1 + ((df[chamber][row]/1000) / float(volume))) / time_difference), 6))
+		new_data_r.append(new_row)
+	df = pandas.DataFrame(new_data_r)
+	df.to_csv(path_or_buf=output, index=False, header=False)
+
+
+def legacy_od_growth(intake, output):
+	"""
+	The original row by row od_growth of Growth-Pipe.py, kept for comparison.
+
+	:param intake: path to data
+	:param output: path for export
+	"""
+	df = pandas.read_csv(intake, header=None, names=['Time',1,2,3,4,5,6,7,8])
+	new_data_r = []
+	time_difference = 0
+	with warnings.catch_warnings():
+		# Growth-Pipe.py turns warnings into errors so invalid values can be caught
+		warnings.simplefilter('error')
+		for row in range(1, df.shape[0]):
+			new_row = []
+			new_row.append(df['Time'][row])
+			time_difference = df['Time'][row] - df['Time'][row - 1]
+			for chamber in range(1, 9):
+				if df[chamber][row] < 0 or df[chamber][row - 1] < 0:
+					new_row.append(None)
+				else:
+					try:
+						new_row.append(round((numpy.log(df[chamber][row] / df[chamber][row - 1]) / time_difference), 6))
+					except (Warning, Exception):
+						new_row.append(None)
+			new_data_r.append(new_row)
+	df = pandas.DataFrame(new_data_r)
+	df.to_csv(path_or_buf=output, index=False, header=False)
+
+
+main()
@@ -13,17 +13,49 @@ INSTRUCTIONS
 	$ python3 Growth-Pipe.py -h
 """
 
+import matplotlib
+# graphs are only saved to files, Agg needs no display and is safe to use from worker processes
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait, as_completed
+from collections import namedtuple
 from datetime import datetime
+import contextlib
+import functools
 import argparse
 import warnings
 import pandas
+import glob
 import numpy
 import math
 import json
 import csv
+import time
+import io
 import os
 
+import odengine
+
+# optional faster JSON decoding for the log parser, falls back to the standard library
+# (ujson is not used, it does not read every float back exactly)
+try:
+	from orjson import loads as json_loads
+except ImportError:
+	json_loads = json.loads
+
+# number of log lines held in memory at once while parsing
+PARSE_CHUNK = 10000
+
+# column types of the parsed datasets, set before converting a chunk so every chunk is written the same way
+# (dilutions are whole pump steps, see write_chunk for logs with fractional ones)
+PARSE_DTYPES = {'u': numpy.int64, 'od': numpy.float64}
+
+# a step of the pipeline, the files it reads (inputs) and writes (outputs) decide which stages it waits for
+Stage = namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'message', 'params', 'current'], defaults=(None,))
+
+# data frames built by the stages of this run, kept for the stages that read their csvs (path to file_key and data frame)
+PRODUCTS = {}
+
 
 def main():
 	"""
@@ -34,7 +66,9 @@ def main():
 	warnings.filterwarnings('error')
 	args = command_line_parameters()
 
-	if os.path.exists(args.config):
+	if os.path.exists(args.config) and args.batch:
+		batch(args)
+	elif os.path.exists(args.config):
 		paths, process_log = config_variables(args)
 		process_log = functions(args, paths, process_log)
 		# print and save process log
@@ -65,9 +99,12 @@ def command_line_parameters():
 	Single inputs: --parse u --growth u
 	Multiple inputs: --parse u od --growth u od
 
-	Optional changes: --config, --log, --print, --volume
-	Optional stats parameters: --interval (-i)
-	Optional graph parameters: --xlim (-x), --ylim (-y), --sd, --se
+	Optional changes: --config, --log, --print, --volume, --incremental, --force
+
+	Batch mode: --batch 'Data/*' runs the functions on every experiment directory,
+		with --summary (combined growth rate table) and --jobs (-j) workers
+	Optional stats parameters: --interval (-i), --long
+	Optional graph parameters: --xlim (-x), --ylim (-y), --sd, --se, --subplots, --jobs (-j)
 				""")
 
 	parser.add_argument('--parse', nargs='+', help='parse data set from log file')
@@ -81,32 +118,52 @@ def command_line_parameters():
 	parser.add_argument('--log', action='store_true', help='optional save program processes to log text file')
 	parser.add_argument('--print', action='store_true', help='optional program processes printing')
 	parser.add_argument('--volume', default='10', help='change ml volume of turbidostat chambers from default 10ml')
+	parser.add_argument('--incremental', action='store_true',
+						help='only process log lines added since the last incremental run and append the results, '
+							'progress is kept in the checkpoint file')
+	parser.add_argument('--force', action='store_true',
+						help='run every stage, even those with outputs that are newer than their inputs')
+	parser.add_argument('--batch', nargs='+',
+						help='run on each of these experiment directories (or glob patterns) in place of directory_path, '
+							'a directory with its own config file uses it')
+	parser.add_argument('--summary', default='growth-summary.csv',
+						help="change batch summary of growth rate stats per experiment and chamber from default 'growth-summary.csv'")
 
 	parser.add_argument('-i', '--interval', default='1',
 						help="modify default hour time interval for stats by multiplication (e.g. '-i 0.5' = 30 min, '-i 2' = 2 hrs)")
+	parser.add_argument('--long', action='store_true',
+						help='write stats as a single long format stats.csv (with a Chamber column) instead of a csv per chamber')
 	parser.add_argument('--sd', action='store_true', help='display standard deviation bars on graphs')
 	parser.add_argument('--se', action='store_true', help='display standard error bars on graphs')
 	parser.add_argument('-x', '--xlim', default='0-0', help="limit data to upper and lower bound x (e.g. '-x 5-10')")
 	parser.add_argument('-y', '--ylim', default='0-0', help="limit data to upper and lower bound y (e.g. '-y 5-10')")
+	parser.add_argument('--subplots', action='store_true',
+						help='graph all chambers as subplots of one figure (chambers.png) instead of a figure per chamber')
+	parser.add_argument('-j', '--jobs', type=int, default=0,
+						help='number of processes rendering graphs (or running experiments in batch mode), defaults to one per core')
 
 	args = parser.parse_args()
 	return args
 
 
-def config_variables(args):
+def config_variables(args, directory=None):
 	"""
 	Reads in variables from config file for growth pipe, ensures directories exist, and starts log for program processes.
 
 	:param args: list of command line arguments
+	:param directory: experiment directory used in place of the config file's directory_path (batch mode)
 	:return: list with config file paths and log with program processes
 	"""
+	config = args.config
+	if directory is not None and os.path.exists(os.path.join(directory, os.path.basename(args.config))):
+		config = os.path.join(directory, os.path.basename(args.config))
 	# begin log to keep track of program processes
 	# read in config file and save all config variables to local variables in a dictionary
 	process_log = '\n[Growth-Pipe] ' + datetime.now().strftime("%Y-%m-%d %H:%M")
 	paths = {
 		# general local variables
 		'' : '', 'fulllog' : '', 'odlog' : '', 'blank' : '', 'block' : '',
-		'log_processes' : '', 'directory_path' : '', 
+		'log_processes' : '', 'directory_path' : '', 'checkpoint' : '', 'stages' : '',
 		# dilution local variables
 		'u' : '', 'u_stats' : '', 'u_machine_time' : '',
 		'u_growth' : '', 'u_growth_stats' : '', 'u_block' : '',
@@ -121,7 +178,7 @@ def config_variables(args):
 		 'od_growth_stats_graphs' : '', 'od_block_graphs' : ''
 	}
 	# loop through growth config file to collect Data and Experiment folder path
-	with open(args.config) as config_file:
+	with open(config) as config_file:
 		reader = list(csv.reader(config_file))
 		for row in reader:
 			if row[0] == 'directory_path':
@@ -129,6 +186,8 @@ def config_variables(args):
 				if len(row[1]) > 0 and row[1][-1] == '/':
 					row[1] = row[1][:-1]
 				paths[row[0]] = row[1]
+	if directory is not None:
+		paths['directory_path'] = directory.rstrip('/')
 
 	# ensure directory path exists, otherwise make new folder
 	exp = ''
@@ -139,7 +198,7 @@ def config_variables(args):
 			process_log += '\nDirectory path not found. Made new one.'
 
 	# loop through growth config file to collect all other paths and add directory path to their beginning
-	with open(args.config) as config_file:
+	with open(config) as config_file:
 		reader = list(csv.reader(config_file))
 		for row in reader:
 			# removes any ending slashes that may exist in csv
@@ -151,10 +210,100 @@ def config_variables(args):
 				row[4] = row[4][:-1]
 			paths[row[3]] = exp + row[4]
 	config_file.close()
+	# config files from before incremental runs have no checkpoint path
+	if not paths['checkpoint']:
+		paths['checkpoint'] = exp + 'growth-pipe-checkpoint.json'
+	if not paths['stages']:
+		paths['stages'] = exp + 'growth-pipe-stages.json'
 
 	return paths, process_log
 
 
+def batch(args):
+	"""
+	Runs the functions on every experiment directory in a pool of worker processes, reports each experiment as it
+	finishes and writes a summary of the growth rates of all experiments.
+
+	:param args: list of command line arguments
+	"""
+	directories = []
+	for pattern in args.batch:
+		directories += [path for path in sorted(glob.glob(pattern)) if os.path.isdir(path) and path not in directories]
+	if not directories:
+		print('ERROR: No experiment directories found.')
+		return
+	jobs = min(args.jobs or os.cpu_count() or 1, len(directories))
+	summary, failed = [], 0
+	with ProcessPoolExecutor(max_workers=jobs) as pool:
+		futures = {pool.submit(run_experiment, args, directory): directory for directory in directories}
+		for count, future in enumerate(as_completed(futures), 1):
+			try:
+				rows, seconds = future.result()
+			except Exception as e:
+				failed += 1
+				print('[{}/{}] {} failed: {}'.format(count, len(directories), futures[future], e))
+				continue
+			summary += rows
+			print('[{}/{}] {} done ({:.1f} s)'.format(count, len(directories), futures[future], seconds))
+	columns = ['Experiment', 'Dataset', 'Chamber', 'Mean', 'SD', 'SE', 'Start Time', 'End Time', 'n']
+	summary = pandas.DataFrame(summary, columns=columns)
+	# experiments in the order they were given, whichever finished first
+	summary['order'] = summary['Experiment'].map({directory: index for index, directory in enumerate(directories)})
+	summary = summary.sort_values(['order', 'Dataset', 'Chamber'], kind='stable').drop(columns='order')
+	with atomic_write(args.summary) as summary_file:
+		summary.to_csv(summary_file, index=False)
+	print('{} of {} experiments done, summary exported to {}'.format(len(directories) - failed, len(directories), args.summary))
+
+
+def run_experiment(args, directory):
+	"""
+	Runs the functions on one experiment directory of a batch (in a worker process).
+
+	:param args: list of command line arguments
+	:param directory: experiment directory
+	:return: summary rows of the experiment's growth rates and seconds taken
+	"""
+	start = time.perf_counter()
+	warnings.filterwarnings('error')
+	# experiments already run in parallel, each renders its graphs in its own process
+	args = argparse.Namespace(**dict(vars(args), jobs=1))
+	# a worker runs several experiments in turn, the data frames of the one before are not needed
+	PRODUCTS.clear()
+	try:
+		paths, process_log = config_variables(args, directory)
+		process_log += '\nBatch experiment {}.'.format(directory)
+		process_log = functions(args, paths, process_log)
+		log_functions(args, paths, process_log)
+		return growth_summary(paths, directory), time.perf_counter() - start
+	finally:
+		PRODUCTS.clear()
+
+
+def growth_summary(paths, experiment):
+	"""
+	Summarizes the growth rates of an experiment, the mean, standard deviation and standard error of every chamber
+	over the whole experiment.
+
+	:param paths: list with config file paths
+	:param experiment: name of the experiment
+	:return: list of rows (experiment, dataset, chamber, mean, SD, SE, start time, end time, n)
+	"""
+	rows = []
+	for dataset in ['u_growth', 'od_growth']:
+		if not os.path.exists(paths[dataset]) or os.path.getsize(paths[dataset]) == 0:
+			continue
+		df = load_csv(paths[dataset])
+		for chamber in range(1, 9):
+			values = df[['Time', chamber]].dropna()
+			if values.empty:
+				continue
+			num = len(values)
+			sd = float(numpy.std(values[chamber]))
+			rows.append([experiment, dataset, chamber, float(numpy.mean(values[chamber])), sd, sd / math.sqrt(num),
+				values['Time'].iloc[0], values['Time'].iloc[-1], num])
+	return rows
+
+
 def functions(args, paths, process_log):
 	"""
 	Runs all functions specified by the command line arguments using the config file variables, while taking note in the log variable.
@@ -164,65 +313,215 @@ def functions(args, paths, process_log):
 	:param process_log: log for keeping track of processes
 	:return: log of all processes that were run
 	"""
+	# incremental runs continue from the checkpoint, full runs start over and make it stale
+	checkpoint = None
+	if args.incremental:
+		checkpoint = read_checkpoint(paths['checkpoint'])
+		process_log += '\n\tIncremental run from checkpoint.'
+	elif (args.parse or args.growth or args.stats or args.block) and os.path.exists(paths['checkpoint']):
+		os.remove(paths['checkpoint'])
+		process_log += '\n\tFull run, removed incremental checkpoint.'
+	stages = pipeline_stages(args, paths, checkpoint)
+	# parameters every stage last ran with, a stage that ran with other parameters is not up to date
+	ran = read_checkpoint(paths['stages'])
+	try:
+		results = run_stages(stages, ran, not (args.incremental or args.force))
+	finally:
+		# stages that finished stay up to date even if another stage failed
+		if stages:
+			write_checkpoint(paths['stages'], ran)
+	if checkpoint is not None:
+		write_checkpoint(paths['checkpoint'], checkpoint)
+	tasks = []
+	for stage in stages:
+		result, message = results[stage.name]
+		process_log += '\n\t' + message
+		# graph stages plan their graphs, which are rendered together in parallel
+		if result:
+			tasks += result
+	if tasks:
+		start = time.perf_counter()
+		render_graphs(tasks, args.jobs)
+		process_log += '\n\tGraphs rendered. ({} graphs, {:.2f} s)'.format(len(tasks), time.perf_counter() - start)
+	return process_log
+
+
+def pipeline_stages(args, paths, checkpoint):
+	"""
+	Declares the stages selected by the command line arguments, in the order they would run one after another.
+
+	:param args: list of command line arguments
+	:param paths: list with config file paths
+	:param checkpoint: dictionary of stage name to its progress, None for a full run
+	:return: list of stages
+	"""
+	stages = []
 	if args.parse:
-		for i in args.parse:
-			if i in ['u', 'od']:
-				parse(paths['fulllog'], paths[i], i)
-				machine_to_human(paths[i], paths[i + '_machine_time'])
-				process_log += '\n\tParsed csv created and exported.'
-			elif i == 'odlog':
-				parse_odlog(paths['odlog'], paths['blank'], paths['od'])
-				machine_to_human(paths['od'], paths['od_machine_time'])
-				process_log += '\n\tParsed csv created and exported.'
+		# u and od are parsed together in one pass over the full log
+		datasets = [i for i in ['u', 'od'] if i in args.parse]
+		if datasets:
+			name = 'parse ' + ' '.join(datasets)
+			outputs = {i: paths[i] for i in datasets}
+			machine_outputs = {i: paths[i + '_machine_time'] for i in datasets}
+			stages.append(Stage(name, functools.partial(parse, paths['fulllog'], outputs, machine_outputs,
+				stage_progress(checkpoint, name)), [paths['fulllog']], list(outputs.values()) + list(machine_outputs.values()),
+				'Parsed csv created and exported.', datasets,
+				# the log can grow while it is parsed, so the csvs are compared to the log by their cache instead of by time
+				lambda: all(cache_current(paths[i], paths['fulllog']) for i in datasets)))
+		if 'odlog' in args.parse:
+			stages.append(Stage('parse odlog', functools.partial(parse_odlog, paths['odlog'], paths['blank'], paths['od'],
+				paths['od_machine_time'], stage_progress(checkpoint, 'parse odlog')), [paths['odlog'], paths['blank']],
+				[paths['od'], paths['od_machine_time']], 'Parsed csv created and exported.', []))
 	if args.growth:
-		for i in args.growth:
-			if i == 'u':
-				u_growth(paths[i], paths[i + '_growth'], args.volume)
-				process_log += '\n\tGrowth rates csv calculated and exported.'
-			elif i == 'od':
-				od_growth(paths[i], paths[i + '_growth'])
-				process_log += '\n\tGrowth rates csv calculated and exported.'
+		if 'u' in args.growth:
+			stages.append(Stage('growth u', functools.partial(u_growth, paths['u'], paths['u_growth'], args.volume,
+				stage_progress(checkpoint, 'growth u')), [paths['u']], [paths['u_growth']],
+				'Growth rates csv calculated and exported.', [args.volume]))
+		if 'od' in args.growth:
+			stages.append(Stage('growth od', functools.partial(od_growth, paths['od'], paths['od_growth'],
+				stage_progress(checkpoint, 'growth od')), [paths['od']], [paths['od_growth']],
+				'Growth rates csv calculated and exported.', []))
 	if args.stats:
 		for i in args.stats:
 			if i in ['u', 'od', 'u_growth', 'od_growth']:
 				validate_output_path(args, paths[i + '_stats'], False)
-				stats(paths[i], paths[i + '_stats'], args.interval)
-				process_log += '\n\tStats csv calculated and exported.'
+				stages.append(Stage('stats ' + i, functools.partial(stats, paths[i], paths[i + '_stats'], args.interval,
+					args.long, stage_progress(checkpoint, 'stats ' + i)), [paths[i]], stats_files(paths[i + '_stats'], args.long),
+					'Stats csv calculated and exported.', [args.interval, args.long]))
 	if args.block:
 		for i in args.block:
-			if i == 'u_growth':
-				validate_output_path(args, paths['u_block'], False)
-				block(paths[i], paths['block'], paths['u_block'], paths['od'], 'u')
-				process_log += '\n\tBlock stats csv calculated and exported.'
-			elif i == 'od_growth':
-				validate_output_path(args, paths['od_block'], False)
-				block(paths[i], paths['block'], paths['od_block'], paths['od'], 'od')
-				process_log += '\n\tBlock stats csv calculated and exported.'
+			if i in ['u_growth', 'od_growth']:
+				dataset = i.split('_')[0]
+				validate_output_path(args, paths[dataset + '_block'], False)
+				stages.append(Stage('block ' + dataset, functools.partial(block, paths[i], paths['block'],
+					paths[dataset + '_block'], paths['od'], dataset, stage_progress(checkpoint, 'block ' + dataset)),
+					[paths[i], paths['block'], paths['od']], block_files(paths[dataset + '_block'], dataset),
+					'Block stats csv calculated and exported.', []))
 	if args.graph:
 		for i in args.graph:
 			if i in ['u', 'od', 'u_growth', 'od_growth']:
 				output, limits = validate_output_path(args, paths[i + '_graphs'], True)
-				graph(paths[i], output, limits)
-				process_log += '\n\tGraphs exported.'
+				run = functools.partial(graph, paths[i], output, limits, args.subplots)
+				inputs = [paths[i]]
 			elif i in ['u_stats', 'od_stats', 'u_growth_stats', 'od_growth_stats']:
 				output, limits = validate_output_path(args, paths[i + '_graphs'], True)
-				stats_graph(paths[i], output, limits, 'Hour', '', args.sd, args.se)
-				process_log += '\n\tGraphs exported.'
-			elif i == 'od_block':
-				output, limits = validate_output_path(args, paths[i + '_graphs'], True)
-				stats_graph(paths[i], output, limits, 'Block', 'od', args.sd, args.se)
-				process_log += '\n\tGraphs exported.'
-			elif i == 'u_block':
+				run = functools.partial(stats_graph, paths[i], output, limits, 'Hour', '', args.sd, args.se, args.subplots)
+				# either format of stats can be graphed
+				inputs = stats_files(paths[i], True) + stats_files(paths[i], False)
+			elif i in ['u_block', 'od_block']:
+				dataset = i.split('_')[0]
 				output, limits = validate_output_path(args, paths[i + '_graphs'], True)
-				stats_graph(paths[i], output, limits, 'Block', 'u', args.sd, args.se)
-				process_log += '\n\tGraphs exported.'
-	return process_log
+				run = functools.partial(stats_graph, paths[i], output, limits, 'Block', dataset, args.sd, args.se, args.subplots)
+				inputs = block_files(paths[i], dataset)
+			else:
+				continue
+			# the limits and error bars are part of the output folder, the subplots of the file names
+			outputs = ['{}/chambers.png'.format(output)] if args.subplots else \
+				['{}/ch{}.png'.format(output, chamber) for chamber in range(1, 9)]
+			stages.append(Stage('graph ' + i, run, inputs, outputs, 'Graphs exported.', []))
+	return stages
+
+
+def stats_files(output, long_format):
+	"""
+	Lists the csvs written by stats.
+
+	:param output: path of the stats folder
+	:param long_format: stats written as a single long format stats.csv
+	:return: list of paths
+	"""
+	if long_format:
+		return ['{}/stats.csv'.format(output)]
+	return ['{}/ch{}.csv'.format(output, chamber) for chamber in range(1, 9)]
+
+
+def block_files(output, dataset):
+	"""
+	Lists the csvs written by block.
+
+	:param output: path of the block folder
+	:param dataset: specifying either OD or U blocks
+	:return: list of paths
+	"""
+	return ['{}/{}_ch{}.csv'.format(output, dataset, chamber) for chamber in range(1, 9)]
+
+
+def run_stages(stages, ran, skip=True):
+	"""
+	Runs stages as a dependency graph in a pool of threads. A stage waits for the stages before it that write its inputs
+	(or the same outputs), stages that do not depend on each other (e.g. the u and od growth rates) run at the same time.
+
+	:param stages: list of stages in the order they would run one after another
+	:param ran: dictionary of stage name to the parameters it last ran with, updated as stages run
+	:param skip: skip stages with outputs that are up to date
+	:return: dictionary of stage name to its result and log line
+	"""
+	depends = {}
+	for index, stage in enumerate(stages):
+		depends[stage.name] = {earlier.name for earlier in stages[:index]
+			if set(earlier.outputs) & (set(stage.inputs) | set(stage.outputs))}
+	results, running, done, changed = {}, {}, set(), set()
+	with ThreadPoolExecutor(max_workers=max(len(stages), 1)) as pool:
+		while len(done) < len(stages):
+			for stage in stages:
+				if stage.name not in done and stage.name not in running.values() and depends[stage.name] <= done:
+					# a stage is not up to date if a stage it depends on has just run
+					fresh = skip and not depends[stage.name] & changed
+					running[pool.submit(run_stage, stage, ran, fresh)] = stage.name
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in finished:
+				name = running.pop(future)
+				result, message, skipped = future.result()
+				results[name] = (result, message)
+				done.add(name)
+				if not skipped:
+					changed.add(name)
+	return results
+
+
+def run_stage(stage, ran, skip):
+	"""
+	Runs one stage, unless it can be skipped and its outputs are up to date, and times it.
+
+	:param stage: stage to run
+	:param ran: dictionary of stage name to the parameters it last ran with
+	:param skip: the stage can be skipped
+	:return: result of the stage (None if skipped), its log line and if it was skipped
+	"""
+	if skip and stage_current(stage, ran):
+		return None, 'Skipped, outputs up to date. ({})'.format(stage.name), True
+	# a stage that fails part way is not up to date
+	ran.pop(stage.name, None)
+	start = time.perf_counter()
+	result = stage.run()
+	ran[stage.name] = stage.params
+	return result, '{} ({}, {:.2f} s)'.format(stage.message, stage.name, time.perf_counter() - start), False
+
+
+def stage_current(stage, ran):
+	"""
+	Checks if the outputs of a stage are up to date: the stage last ran with the same parameters, all its outputs exist
+	and they are newer than its inputs (inputs that do not exist are left out).
+
+	:param stage: stage to check
+	:param ran: dictionary of stage name to the parameters it last ran with
+	:return: true if the stage can be skipped
+	"""
+	if stage.name not in ran or ran[stage.name] != stage.params:
+		return False
+	if not stage.outputs or not all(os.path.exists(path) for path in stage.outputs):
+		return False
+	if stage.current is not None:
+		return stage.current()
+	inputs = [os.stat(path).st_mtime_ns for path in stage.inputs if os.path.exists(path)]
+	return not inputs or min(os.stat(path).st_mtime_ns for path in stage.outputs) >= max(inputs)
 
 
 def machine_to_human(intake, output):
 	"""
 	Converts machine time (seconds with starting time long ago) to hours from experiment start.
 	Generates new csv and renames the old csv.
+	Parsing does this conversion in-stream, this is for csvs that were parsed without it.
 
 	:param intake: path to data
 	:param output: path for export
@@ -231,22 +530,272 @@ def machine_to_human(intake, output):
 	time_start = df.iloc[0, 0]
 	# Checks if the first time point is in machine time
 	if time_start > 1:
-		# Renames the csv using machine time
-		command = "mv '{}' '{}'".format(intake, output)
-		os.system(command)
-		new_data = []
-		# Iterates through rows of csv and changes time point to hours in new row array
-		# Joins each array into new data array and saves to a new csv
-		for row in range(df.shape[0]):
-			new_row = []
-			temp = round((df['Time'][row] - time_start) / 3600, 4)
-			new_row.append(temp)
-			for chamber in range(1, 9):
-				temp = round(df[chamber][row], 4)
-				new_row.append(temp)
-			new_data.append(new_row)
-		df = pandas.DataFrame(new_data)
-		df.to_csv(path_or_buf=intake, index=False, header=False)
+		with atomic_write(intake, keep=output) as human_file:
+			to_human(df, time_start).to_csv(human_file, index=False, header=False)
+
+
+def to_human(df, time_start):
+	"""
+	Converts the time column (the first) of a data frame from machine time to hours from experiment start.
+	Every value is rounded to 4 places, integer columns are left as they are.
+
+	:param df: data frame in machine time
+	:param time_start: machine time of the experiment start
+	:return: data frame in hours
+	"""
+	human = df.round(4)
+	human[df.columns[0]] = ((df[df.columns[0]] - time_start) / 3600).round(4)
+	return human
+
+
+@contextlib.contextmanager
+def atomic_write(path, keep=None):
+	"""
+	Opens a temporary file next to path for writing, which replaces path (os.replace) only once it is complete,
+	so a csv is never seen half written.
+
+	:param path: path for export
+	:param keep: optional path the existing file at path is moved to before it is replaced
+	"""
+	temp_path = '{}.{}.tmp'.format(path, os.getpid())
+	try:
+		with open(temp_path, 'w', newline='') as temp_file:
+			yield temp_file
+	except BaseException:
+		os.remove(temp_path)
+		raise
+	if keep is not None:
+		os.replace(path, keep)
+	os.replace(temp_path, path)
+
+
+def read_checkpoint(path):
+	"""
+	Reads the checkpoint of incremental runs, the progress of every stage (parse, growth, stats, block) so far.
+
+	:param path: path to the checkpoint
+	:return: dictionary of stage name to its progress, empty if there is no checkpoint yet
+	"""
+	if not os.path.exists(path):
+		return {}
+	with open(path, 'r') as checkpoint_file:
+		return json.load(checkpoint_file)
+
+
+def write_checkpoint(path, checkpoint):
+	"""
+	Saves the checkpoint of incremental runs.
+
+	:param path: path for export
+	:param checkpoint: dictionary of stage name to its progress
+	"""
+	with atomic_write(path) as checkpoint_file:
+		json.dump(checkpoint, checkpoint_file)
+
+
+def stage_progress(checkpoint, stage):
+	"""
+	Gets the progress of one stage from the checkpoint.
+
+	:param checkpoint: dictionary of stage name to its progress, None for a full run
+	:param stage: name of the stage
+	:return: progress dictionary (updated in place by the stage), None for a full run
+	"""
+	if checkpoint is None:
+		return None
+	return checkpoint.setdefault(stage, {})
+
+
+def read_new_lines(intake, progress, key='offset'):
+	"""
+	Reads the complete lines added to a file since the last incremental run and moves the offset in progress past them.
+	A line still being written is left for the next run.
+
+	:param intake: path to data
+	:param progress: progress dictionary holding the byte offset
+	:param key: key of the offset in progress
+	:return: bytes of the new lines
+	"""
+	offset = progress.get(key, 0)
+	if os.path.getsize(intake) < offset:
+		raise ValueError("'{}' is shorter than at the last incremental run, remove the checkpoint to start over".format(intake))
+	with open(intake, 'rb') as data_file:
+		data_file.seek(offset)
+		data = data_file.read()
+	data = data[:data.rfind(b'\n') + 1]
+	progress[key] = offset + len(data)
+	return data
+
+
+def read_rows(intake, progress, key='offset'):
+	"""
+	Reads a csv of a time column followed by a column per chamber.
+	In incremental runs (progress given) only the rows added since the last run are read.
+
+	:param intake: path to data
+	:param progress: incremental state of the stage reading the csv, None for a full run
+	:param key: key of the byte offset in progress
+	:return: data frame of the rows
+	"""
+	names = ['Time', 1, 2, 3, 4, 5, 6, 7, 8]
+	if progress is None:
+		return load_csv(intake)
+	data = read_new_lines(intake, progress, key)
+	if not data:
+		return pandas.DataFrame(columns=names)
+	return pandas.read_csv(io.BytesIO(data), header=None, names=names)
+
+
+def prepend_rows(rows, df):
+	"""
+	Puts rows carried over from the last incremental run in front of the new rows.
+
+	:param rows: list of carried over rows, or None
+	:param df: data frame of the new rows
+	:return: data frame of all rows
+	"""
+	if not rows:
+		return df
+	carried = pandas.DataFrame(rows, columns=df.columns)
+	if df.empty:
+		return carried
+	return pandas.concat([carried, df], ignore_index=True)
+
+
+def append_output(path):
+	"""
+	Opens an existing csv to append the rows of an incremental run.
+
+	:param path: path for export
+	:return: open file
+	"""
+	return open(path, 'a', newline='')
+
+
+def write_results(path, final, provisional, progress, header=None):
+	"""
+	Writes a result csv. Final rows are kept, while provisional rows (a stats interval or block that is still open)
+	are replaced by the next incremental run, which cuts the csv back to where they start before appending.
+
+	:param path: path for export
+	:param final: data frame of rows that will not change
+	:param provisional: data frame of rows that can still change, or None
+	:param progress: incremental state of the stage, None for a full run
+	:param header: list of column names written at the start of a new csv
+	"""
+	outputs = progress.setdefault('outputs', {}) if progress is not None else {}
+	if path in outputs and os.path.exists(path):
+		os.truncate(path, outputs[path])
+		out_file = append_output(path)
+	else:
+		out_file = open(path, 'w', newline='')
+		if header is not None:
+			pandas.DataFrame([header]).to_csv(out_file, index=False, header=False)
+	with out_file:
+		if not final.empty:
+			final.to_csv(out_file, index=False, header=False)
+		out_file.flush()
+		outputs[path] = out_file.tell()
+		if provisional is not None and not provisional.empty:
+			provisional.to_csv(out_file, index=False, header=False)
+
+
+def file_key(path):
+	"""
+	Identifies the current contents of a file by its size and modification time.
+
+	:param path: path to the file
+	:return: list of size and modification time (ns)
+	"""
+	stat = os.stat(path)
+	return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_cache(path, df, source, source_key=None):
+	"""
+	Keeps the data frame a stage wrote to a csv in PRODUCTS for the later stages of this run, and writes a columnar
+	cache of it next to the csv, one .npy file per column in the '<csv>.cache' folder, so later runs can memory map the
+	data instead of parsing the text again. The cache is keyed by the size and modification time of the csv and of the
+	source log it was made from.
+
+	:param path: path to the csv
+	:param df: data frame written to the csv, a time column followed by a column per chamber
+	:param source: path to the log the csv was made from
+	:param source_key: file_key of the log from before it was read, defaults to its current key
+	"""
+	directory = path + '.cache'
+	meta = os.path.join(directory, 'meta.json')
+	if os.path.exists(meta):
+		# the cache is invalid while it is rewritten
+		os.remove(meta)
+	if df.empty:
+		return
+	# named and typed as load_csv reads the csv
+	df = df.set_axis(['Time'] + list(range(1, len(df.columns))), axis=1)
+	df = df.astype({column: numpy.float64 for column in df.columns if df[column].dtype == object})
+	PRODUCTS[path] = (file_key(path), df)
+	# columns that are not numbers can not be memory mapped
+	if any(dtype == object for dtype in df.dtypes):
+		return
+	if not os.path.exists(directory):
+		os.mkdir(directory)
+	for column in df.columns:
+		numpy.save(os.path.join(directory, '{}.npy'.format(column)), df[column].values)
+	with atomic_write(meta) as meta_file:
+		json.dump({'columns': [str(column) for column in df.columns], 'csv': file_key(path),
+			'source': [source] + (source_key or file_key(source))}, meta_file)
+
+
+def read_cache_meta(path):
+	"""
+	Reads the description of a csv's columnar cache.
+
+	:param path: path to the csv
+	:return: dictionary of the cache columns and keys, None if there is no cache or the csv changed since
+	"""
+	meta = os.path.join(path + '.cache', 'meta.json')
+	if not os.path.exists(meta) or not os.path.exists(path):
+		return None
+	with open(meta, 'r') as meta_file:
+		meta = json.load(meta_file)
+	if meta['csv'] != file_key(path):
+		return None
+	return meta
+
+
+def cache_current(path, source):
+	"""
+	Checks if a csv and its cache were made from the source log as it is now.
+
+	:param path: path to the csv
+	:param source: path to the log the csv is made from
+	:return: true if the log has not changed since the csv was made
+	"""
+	meta = read_cache_meta(path)
+	return meta is not None and os.path.exists(source) and meta['source'] == [source] + file_key(source)
+
+
+def load_csv(path):
+	"""
+	Reads a csv of a time column followed by a column per chamber.
+	A csv written earlier in this run is taken from the data frame its stage built, otherwise the columns are memory
+	mapped from the csv's cache (without copying) when it is up to date, or else the csv is parsed.
+
+	:param path: path to data
+	:return: data frame of the csv
+	"""
+	product = PRODUCTS.get(path)
+	if product is not None and product[0] == file_key(path):
+		# made by a stage of this run, a shallow copy keeps columns added by the reading stage out of the product
+		return product[1].copy(deep=False)
+	meta = read_cache_meta(path)
+	if meta is None:
+		return pandas.read_csv(path, header=None, names=['Time',1,2,3,4,5,6,7,8])
+	columns = {}
+	for column in meta['columns']:
+		values = numpy.load(os.path.join(path + '.cache', '{}.npy'.format(column)), mmap_mode='r')
+		columns[column if column == 'Time' else int(column)] = values
+	return pandas.DataFrame(columns, copy=False)
 
 
 def validate_output_path(args, output, function):
@@ -285,185 +834,317 @@ def validate_output_path(args, output, function):
 	return output, limits
 
 
-def parse(intake, output, dataset):
+def parse(intake, outputs, machine_outputs=None, progress=None):
 	"""
-	Parses OD or U values from the fulllog file.
+	Parses OD and/or U values from the fulllog file in a single streaming pass.
+	Lines are decoded and written in chunks of PARSE_CHUNK, so memory use does not grow with the log.
+	If machine_outputs is given, outputs get time in hours from experiment start (as machine_to_human) and
+	machine_outputs get the machine time, both written in the same pass.
+	In incremental runs (progress given) parsing starts at the byte offset the last run stopped at and the rows are appended.
 
 	:param intake: path to data
-	:param output: path for export
-	:param dataset: either OD or U values to parse
+	:param outputs: dictionary of dataset ('u' or 'od') to path for export
+	:param machine_outputs: optional dictionary of dataset to path for export in machine time
+	:param progress: incremental state of this stage from the checkpoint, None for a full run
 	"""
-	if dataset == 'od':
-		dataset = 'ods'
-	logfile = open(intake, 'r')  # open input file
-	logdata = logfile.readlines()
-	logfile.close()
-
-	data = []
-	for line in logdata:
-		if len(line) > 0:
-			temp_data = json.loads(line)
-			data.append([temp_data['timestamp']] + temp_data[dataset])
-	ufile = open(output, 'w')
-	writer = csv.writer(ufile)
-	writer.writerows(data)
-	ufile.close()
+	keys = {'u': 'u', 'od': 'ods'}
+	machine_outputs = machine_outputs or {}
+	# taken before reading, lines the controller adds meanwhile make the cache out of date rather than being missed
+	source_key = file_key(intake)
+	offset, time_start, timestamp = 0, None, None
+	if progress is not None:
+		offset, time_start, timestamp = progress.get('offset', 0), progress.get('time_start'), progress.get('timestamp')
+	open_output = append_output if offset > 0 else atomic_write
+	with contextlib.ExitStack() as stack:
+		files = {dataset: stack.enter_context(open_output(path)) for dataset, path in outputs.items()}
+		machine_files = {dataset: stack.enter_context(open_output(path)) for dataset, path in machine_outputs.items()}
+		writers = {dataset: csv.writer(machine_files.get(dataset, files[dataset])) for dataset in outputs}
+		chunks = {dataset: [] for dataset in outputs}
+		# the rows written to outputs, kept for the later stages in full runs
+		frames = {dataset: [] for dataset in outputs}
+		count = 0
+		with open(intake, 'rb') as logfile:
+			logfile.seek(offset)
+			for line in logfile:
+				# a line still being written by the controller is left for the next incremental run
+				if progress is not None and not line.endswith(b'\n'):
+					break
+				offset += len(line)
+				if line.strip():
+					temp_data = json_loads(line)
+					timestamp = temp_data['timestamp']
+					if time_start is None:
+						time_start = timestamp
+					for dataset, chunk in chunks.items():
+						chunk.append([timestamp] + temp_data[keys[dataset]])
+					count += 1
+					if count % PARSE_CHUNK == 0:
+						for dataset, chunk in chunks.items():
+							frame = write_chunk(chunk, writers[dataset], files[dataset] if dataset in machine_files else None,
+								time_start, PARSE_DTYPES[dataset])
+							if progress is None:
+								frames[dataset].append(frame)
+							chunks[dataset] = []
+		for dataset, chunk in chunks.items():
+			frame = write_chunk(chunk, writers[dataset], files[dataset] if dataset in machine_files else None, time_start,
+				PARSE_DTYPES[dataset])
+			if progress is None and frame is not None:
+				frames[dataset].append(frame)
+	if progress is not None:
+		progress.update({'offset': offset, 'time_start': time_start, 'timestamp': timestamp})
+	else:
+		for dataset, path in outputs.items():
+			df = pandas.concat(frames[dataset], ignore_index=True) if frames[dataset] else pandas.DataFrame()
+			write_cache(path, df, intake, source_key)
 
 
-def parse_odlog(odlog, blank, output):
+def write_chunk(chunk, writer, human_file, time_start, dtype):
+	"""
+	Writes a chunk of parsed rows, and the same rows in hours from experiment start if human_file is given.
+	The values are converted with the given column type rather than the one pandas infers from the chunk, so the
+	output does not depend on where the chunks are split. Integer columns holding fractions or missing values are
+	written value by value, whole numbers as integers and the rest as floats.
+
+	:param chunk: list of rows, time followed by one value per chamber
+	:param writer: csv writer for the rows as they are
+	:param human_file: open file for the rows in hours, or None
+	:param time_start: machine time of the experiment start
+	:param dtype: type of the value columns, numpy.int64 or numpy.float64
+	:return: data frame of the rows in hours if human_file is given, else in machine time, None for an empty chunk
+	"""
+	if not chunk:
+		return None
+	writer.writerows(chunk)
+	df = pandas.DataFrame(chunk, dtype=numpy.float64)
+	if dtype is numpy.int64:
+		# NaN is never equal to itself, so missing values do not count as whole
+		whole = df[df.columns[1:]] == df[df.columns[1:]].round()
+		if whole.values.all():
+			df = df.astype({column: numpy.int64 for column in df.columns[1:]})
+		elif human_file is not None:
+			df = df.round(4)
+			for column in df.columns[1:]:
+				df[column] = pandas.Series([int(value) if is_whole else value
+					for value, is_whole in zip(df[column], whole[column])], dtype=object)
+	if human_file is not None:
+		df = to_human(df, time_start)
+		df.to_csv(human_file, index=False, header=False)
+	return df
+
+
+def parse_odlog(odlog, blank, output, machine_output=None, progress=None):
 	"""
 	Parses optical density values from the odlog file.
+	If machine_output is given, output gets time in hours from experiment start (as machine_to_human) and
+	machine_output gets the machine time.
+	In incremental runs (progress given) only the lines added since the last run are parsed and appended.
 
 	:param odlog: path to od data
 	:param blank: path to blank od data
 	:param output: path for export
+	:param machine_output: optional path for export in machine time
+	:param progress: incremental state of this stage from the checkpoint, None for a full run
 	"""
-	blank_file = open(blank, 'r')
-	blank_content = blank_file.read()
-	blank_file.close()
-	blank_data = list(map(int, blank_content.split()))
-	btx = blank_data[0::2]
-	brx = blank_data[1::2]
-
-	odlog_file = open(odlog, 'r')
-	odlog_content = odlog_file.readlines()
-	odlog_file.close()
+	btx, brx = odengine.read_blank(blank)
+	source_key = file_key(odlog)
+	time_start = None
+	open_output = atomic_write
+	if progress is None:
+		timestamps, tx, rx = odengine.read_odlog(odlog)
+	else:
+		data = read_new_lines(odlog, progress)
+		if not data:
+			return
+		timestamps, tx, rx = odengine.read_odlog(io.BytesIO(data))
+		time_start = progress.get('time_start')
+		if time_start is not None:
+			open_output = append_output
+	ods = odengine.compute_ods(btx, brx, tx, rx)
 	od_list = []
-	for line in odlog_content:
-		line = list(map(int, line.split()))
-		temp_ods = [int(line[0])]
-		tx = line[1::2]
-		rx = line[2::2]
-		for num in range(8):
-			if tx[num] == 0 or rx[num] == 0 or brx[num] == 0 or btx[num] == 0:
-				temp_ods.append(0)
-				continue
-			blank_od = float(brx[num]) / float(btx[num])
-			od_measure = float(rx[num]) / float(tx[num])
-			temp_ods.append(math.log10(blank_od/od_measure))
-		od_list.append(temp_ods)
-	odfile = open(output, 'w')
-	wrod = csv.writer(odfile, quoting=csv.QUOTE_ALL)
-	wrod.writerows(od_list)
-	odfile.close()
+	for timestamp, row in zip(timestamps.tolist(), ods.tolist()):
+		# int 0 for unreadable chambers, so the csv has '0' as before rather than '0.0'
+		od_list.append([timestamp] + [od if od != 0 else 0 for od in row])
+	if time_start is None and od_list:
+		time_start = od_list[0][0]
+	with open_output(machine_output or output) as odfile:
+		wrod = csv.writer(odfile, quoting=csv.QUOTE_ALL)
+		wrod.writerows(od_list)
+	df = pandas.DataFrame(od_list)
+	if machine_output and od_list:
+		df = to_human(df, time_start)
+		with open_output(output) as odfile:
+			df.to_csv(odfile, index=False, header=False)
+	if progress is not None:
+		progress['time_start'] = time_start
+	else:
+		write_cache(output, df, odlog, source_key)
 
 
-def u_growth(intake, output, volume):
+def u_growth(intake, output, volume, progress=None):
 	"""
 	Calculates growth rate data based on dilutions (u) and saves to csv.
+	In incremental runs (progress given) the last row of the previous run is carried over and new rates are appended.
 
 	:param intake: path to data
 	:param output: path for export
 	:param volume: volume of the turbidostat growth chamber
+	:param progress: incremental state of this stage from the checkpoint, None for a full run
 	"""
-	df = pandas.read_csv(intake, header=None, names=['Time',1,2,3,4,5,6,7,8])
-	new_data_r = []
-	time_start = df['Time'][0]
-	time_difference = 0
-	for row in range(1, df.shape[0]):
-		new_row = []
-		# time point and time difference is calculated (should always be 60 sec)
-		new_row.append(df['Time'][row] - time_start)
-		time_difference = df['Time'][row] - df['Time'][row - 1]
-		for chamber in range(1, 9):
-			# if first row of data frame (determined by time point) or zero value, it is arbitrarily set to zero
-			if df[chamber][row] == 0:
-				new_row.append(float(0))
-			# rest of elements will be values that do not cause errors when calculating growth rate
-			else:
-				# convert dilution to ul then divide by the ml of the chamber
-				new_row.append(round((numpy.log(1 + ((df[chamber][row]/1000) / float(volume))) / time_difference), 6)) # pylint: disable=E1101
-		new_data_r.append(new_row)
-	df = pandas.DataFrame(new_data_r)
-	df.to_csv(path_or_buf=output, index=False, header=False)
-
-
-def od_growth(intake, output):
+	df = read_rows(intake, progress)
+	time_start = None
+	if progress is not None:
+		if df.empty:
+			return
+		df = prepend_rows(progress.get('previous'), df)
+		progress['previous'] = df.tail(1).values.tolist()
+		time_start = progress.setdefault('time_start', df['Time'].iloc[0].item())
+	times = df['Time'].values
+	if time_start is None:
+		time_start = times[0]
+	u = df[list(range(1, 9))].values[1:]
+	# time difference between each row and the one before it (should always be 60 sec)
+	time_difference = numpy.diff(times)[:, None]
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		# convert dilution to ul then divide by the ml of the chamber
+		rates = numpy.round(numpy.log(1 + ((u / 1000) / float(volume))) / time_difference, 6)
+	# zero dilutions are arbitrarily set to a zero growth rate
+	rates[u == 0] = 0.0
+	growth = growth_frame(times[1:] - time_start, rates)
+	write_results(output, growth, None, progress)
+	if progress is None:
+		write_cache(output, growth, intake)
+
+
+def od_growth(intake, output, progress=None):
 	"""
 	Calculates growth rate data based on optical density (od) and saves to csv.
+	In incremental runs (progress given) the last row of the previous run is carried over and new rates are appended.
 
 	:param intake: path to data
 	:param output: path for export
+	:param progress: incremental state of this stage from the checkpoint, None for a full run
 	"""
-	df = pandas.read_csv(intake, header=None, names=['Time',1,2,3,4,5,6,7,8])
-	new_data_r = []
-	time_difference = 0
-	for row in range(1, df.shape[0]):
-		new_row = []
-		# time point and time difference is calculated (should always be 60 sec)
-		new_row.append(df['Time'][row])
-		time_difference = df['Time'][row] - df['Time'][row - 1]
-		for chamber in range(1, 9):
-			# negative OD's are ignored with growth rate being a blank space
-			if df[chamber][row] < 0 or df[chamber][row - 1] < 0:
-				new_row.append(None)
-			else:
-				try:
-					new_row.append(round((numpy.log(df[chamber][row] / df[chamber][row - 1]) / time_difference), 6)) # pylint: disable=E1101
-				# if the growth rate calculation fails (it will for values <= 0) then append a blank space
-				except (Warning, Exception) as err:
-					# for showing the warning or exception, uncomment the below line
-					# print('{}'.format(err))
-					new_row.append(None)
-		new_data_r.append(new_row)
-	df = pandas.DataFrame(new_data_r)
-	df.to_csv(path_or_buf=output, index=False, header=False)
+	df = read_rows(intake, progress)
+	if progress is not None:
+		if df.empty:
+			return
+		df = prepend_rows(progress.get('previous'), df)
+		progress['previous'] = df.tail(1).values.tolist()
+	times = df['Time'].values
+	ods = df[list(range(1, 9))].values
+	current, previous = ods[1:], ods[:-1]
+	# time difference between each row and the one before it (should always be 60 sec)
+	time_difference = numpy.diff(times)[:, None]
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		rates = numpy.round(numpy.log(current / previous) / time_difference, 6)
+	# the growth rate is undefined for non-positive OD's (or no elapsed time), these are left as a blank space
+	rates[~((current > 0) & (previous > 0) & (time_difference != 0))] = numpy.nan
+	growth = growth_frame(times[1:], rates)
+	write_results(output, growth, None, progress)
+	if progress is None:
+		write_cache(output, growth, intake)
+
+
+def growth_frame(times, rates):
+	"""
+	Builds the data frame of a growth rate csv, a time column followed by one column of rates per chamber.
+
+	:param times: array of time points
+	:param rates: 2D array of growth rates, one row per time point
+	:return: data frame ready for export
+	"""
+	df = pandas.DataFrame(rates, columns=range(1, rates.shape[1] + 1))
+	df.insert(0, 0, times)
+	return df
 
 
-def stats(intake, output, interval):
+def stats(intake, output, interval, long_format=False, progress=None):
 	"""
 	Analyzes growth rate csv for general statistics (averages, standard deviation, and standard error).
+	Rows are binned by floor(Time / interval) and the stats of every chamber are computed in one grouped aggregation.
+	Each bin is labelled by the hour it ends at (e.g. times 0 up to 1 are hour 1), bins without data are left out.
+	The last bin may still be open, in incremental runs (progress given) its rows are carried over and
+	its stats are rewritten with the new rows.
 
 	:param intake: path to data
 	:param output: path for export
 	:param interval: modify default hour time interval by multiplication
+	:param long_format: write a single stats.csv with a Chamber column instead of a csv per chamber
+	:param progress: incremental state of this stage from the checkpoint, None for a full run
 	"""
-	df = pandas.read_csv(intake, header=None, names=['Time',1,2,3,4,5,6,7,8])
-	# for each chamber, iterate through dataframe to calculate stats
+	# multiply default 1 hour by command line argument
+	hour = 1 * float(interval)
+	if progress is not None and (progress.get('interval', hour) != hour or progress.get('long', long_format) != long_format):
+		# the stats so far were binned differently, start over
+		progress.clear()
+	df = read_rows(intake, progress)
+	if progress is not None:
+		if df.empty:
+			return
+		df = prepend_rows(progress.get('rows'), df)
+		progress.update({'interval': hour, 'long': long_format})
+	df['Hour'] = (numpy.floor(df['Time'] / hour) + 1) * hour
+	open_hour = df['Hour'].iloc[-1] if not df.empty else None
+	if progress is not None:
+		progress['rows'] = df[df['Hour'] >= open_hour].drop(columns='Hour').values.tolist()
+	# one row per chamber and time point, NaN's are not counted in the stats
+	values = df.melt(id_vars=['Time', 'Hour'], var_name='Chamber', value_name='Value').dropna(subset=['Value'])
+	grouped = values.groupby(['Chamber', 'Hour'], sort=True)
+	table = pandas.DataFrame({
+		'Mean': grouped['Value'].mean(), 'SD': grouped['Value'].std(ddof=0),
+		'Start Time': grouped['Time'].first(), 'End Time': grouped['Time'].last(), 'n': grouped['Value'].count()})
+	table['SE'] = table['SD'] / numpy.sqrt(table['n'])
+	table = table.reset_index()[['Chamber', 'Hour', 'Mean', 'SD', 'SE', 'Start Time', 'End Time', 'n']]
+	if long_format:
+		table = table.sort_values(['Hour', 'Chamber'], kind='stable')
+		write_results('{}/stats.csv'.format(output), table[table['Hour'] != open_hour],
+			table[table['Hour'] == open_hour], progress, list(table.columns))
+		return
 	for chamber in range(1, 9):
-		start_time, end_time = 0, 0
-		new_block = []
-		# multiply default 1 hour by command line argument
-		hour = 1 * float(interval)
-		block = [['Hour', 'Mean', 'SD', 'SE', 'Start Time', 'End Time', 'n']]
-		for row in range(df.shape[0]):
-			# if the end of the hour unit has been reached, then save stats on that hour
-			if (df['Time'][row] >= hour or row == df.shape[0] - 1) and len(new_block) >= 1:
-				num, mean, sd = len(new_block), numpy.mean(new_block), numpy.std(new_block)
-				sem = sd / numpy.sqrt(num)
-				block.append([hour, mean, sd, sem, start_time, end_time, num])
-				# multiply default 1 hour by command line argument
-				hour += 1 * float(interval)
-				new_block = []
-			# if element is a number (not a NaN) then add to block
-			if not math.isnan(df[chamber][row]):
-				if len(new_block) == 0:
-					start_time = df['Time'][row]
-				new_block.append(df[chamber][row])
-				end_time = df['Time'][row]
-		stats = pandas.DataFrame(block)
-		stats.to_csv(path_or_buf='{}/ch{}.csv'.format(output, chamber), index=False, header=False)
-
-
-def block(intake, block, output, odraw, dataset):
+		chamber_table = table[table['Chamber'] == chamber].drop(columns='Chamber')
+		write_results('{}/ch{}.csv'.format(output, chamber), chamber_table[chamber_table['Hour'] != open_hour],
+			chamber_table[chamber_table['Hour'] == open_hour], progress, list(chamber_table.columns))
+
+
+def block(intake, block, output, odraw, dataset, progress=None):
 	"""
 	Analyzes growth rate csv for general statistics (averages, standard deviation, and standard error).
+	In incremental runs (progress given) the state of every chamber's block is carried over, the block that is
+	still open is rewritten with the new rows.
 
 	:param intake: path to data
 	:param block: path to block log data
 	:param output: path for export
 	:param odraw: optical density data for use in block analysis
 	:param dataset: specifying either OD or U blocks
+	:param progress: incremental state of this stage from the checkpoint, None for a full run
 	"""
-	df = pandas.read_csv(intake, header=None, names=['Time', 1, 2, 3, 4, 5, 6, 7, 8])
 	blocklog_file = open(block, 'r')
 	blocklog = list(csv.reader(blocklog_file))
 	blocklog_file.close()
 	mode = blocklog[0][2]
 	if mode == 'chamber' and dataset == 'u':
 		return
+	df = read_rows(intake, progress)
+	# join every growth rate row to the od at its time point once, instead of searching the od data for each row
+	ods = read_rows(odraw, progress, 'od_offset')
+	if progress is not None:
+		ods = prepend_rows(progress.get('od_rows'), ods)
+		if df.empty:
+			progress['od_rows'] = ods.values.tolist()
+			return
+		# ods from the last growth rate time point on can still be joined to the rows of the next run
+		progress['od_rows'] = ods[ods['Time'] >= df['Time'].iloc[-1]].values.tolist()
+	ods['Time'] = ods['Time'].astype(float)
+	times = df[['Time']].astype(float).reset_index().sort_values('Time', kind='stable')
+	joined = pandas.merge_asof(times, ods.sort_values('Time', kind='stable'), on='Time', direction='nearest')
+	joined = joined.set_index('index').sort_index()
+	times = df['Time'].tolist()
+	carried = progress.setdefault('chambers', {}) if progress is not None else {}
 	for chamber in range(1, 9):
-		blockdict = {'setpoint': [float(blocklog[0][3].split(',')[chamber - 1])], 
+		rates = df[chamber].tolist()
+		chamber_ods = joined[chamber].tolist()
+		blockdict = {'setpoint': [float(blocklog[0][3].split(',')[chamber - 1])],
 					'start': [0.0], 'start time': 0.0, 'end time': 0.0, 'new block': []}
 		count = 0
 		for row in blocklog:
@@ -475,13 +1156,18 @@ def block(intake, block, output, odraw, dataset):
 		state = 'initial growth'
 		if mode == 'chamber':
 			state = 'growth'
-		outblock = [['Block', 'Mean', 'SD', 'SE', 'Block Start', 'Block End', 'Start Time', 'End Time', 'n']]
+		if str(chamber) in carried:
+			saved = carried[str(chamber)]
+			count, state = saved['count'], saved['state']
+			for key in ['start time', 'end time', 'new block']:
+				blockdict[key] = saved[key]
+		header = ['Block', 'Mean', 'SD', 'SE', 'Block Start', 'Block End', 'Start Time', 'End Time', 'n']
 		if dataset == 'u':
-			outblock = [['Block', 'Alignment', 'Mean', 'SD', 'SE', 'Block Start', 'Block End', 'Start Time', 'End Time', 'n']]
-		ods = pandas.read_csv(odraw, header=None, names=['Time', 1, 2, 3, 4, 5, 6, 7, 8])
-		for row in range(df.shape[0]):
-			try:
-				if df['Time'][row] >= blockdict['start'][count + 1]:
+			header = ['Block', 'Alignment', 'Mean', 'SD', 'SE', 'Block Start', 'Block End', 'Start Time', 'End Time', 'n']
+		outblock, open_block = [], []
+		for row in range(len(times)):
+			if count + 1 < len(blockdict['start']):
+				if times[row] >= blockdict['start'][count + 1]:
 					if blockdict['setpoint'][count] > blockdict['setpoint'][count + 1]:
 						state = 'initial dilution'
 						if mode == 'chamber':
@@ -497,31 +1183,34 @@ def block(intake, block, output, odraw, dataset):
 						if dataset == 'u':
 							blockdict, outblock = update_outblock(blockdict, count, outblock, 'Lower')
 					count += 1
-			except:
-				if row == df.shape[0] - 1:
-					blockdict['start'].append('')
-					if dataset == 'od':
-						update_outblock(blockdict, count, outblock, '')
-					elif dataset == 'u' and state == 'stable growth':
-						update_outblock(blockdict, count, outblock, 'Upper')
-					elif dataset == 'u' and state == 'stable dilution':
-						update_outblock(blockdict, count, outblock, 'Lower')
-			if state == 'initial growth' and ods[ods['Time'] == df['Time'][row]][chamber].values[0] >= (blockdict['setpoint'][count] - blockdict['setpoint'][count] * 0.05):
+			# after the last block starts, the data that is left closes it for now
+			# (on a copy, an incremental run continues the block and rewrites it)
+			elif row == len(times) - 1:
+				closing = dict(blockdict, start=blockdict['start'] + [''])
+				if dataset == 'od':
+					update_outblock(closing, count, open_block, '')
+				elif dataset == 'u' and state == 'stable growth':
+					update_outblock(closing, count, open_block, 'Upper')
+				elif dataset == 'u' and state == 'stable dilution':
+					update_outblock(closing, count, open_block, 'Lower')
+			if state == 'initial growth' and chamber_ods[row] >= (blockdict['setpoint'][count] - blockdict['setpoint'][count] * 0.05):
 				state = 'stable growth'
-			if state == 'initial dilution' and ods[ods['Time'] == df['Time'][row]][chamber].values[0] <= (blockdict['setpoint'][count] + blockdict['setpoint'][count] * 0.05):
+			if state == 'initial dilution' and chamber_ods[row] <= (blockdict['setpoint'][count] + blockdict['setpoint'][count] * 0.05):
 				state = 'stable dilution'
-			if dataset == 'od' and state in ['growth', 'initial growth'] and not math.isnan(df[chamber][row]):
+			if dataset == 'od' and state in ['growth', 'initial growth'] and not math.isnan(rates[row]):
 				if len(blockdict['new block']) == 0:
-					blockdict['start time'] = df['Time'][row]
-				blockdict['new block'].append(df[chamber][row])
-				blockdict['end time'] = df['Time'][row]
-			if dataset == 'u' and state in ['stable growth', 'stable dilution'] and not math.isnan(df[chamber][row]):
+					blockdict['start time'] = times[row]
+				blockdict['new block'].append(rates[row])
+				blockdict['end time'] = times[row]
+			if dataset == 'u' and state in ['stable growth', 'stable dilution'] and not math.isnan(rates[row]):
 				if len(blockdict['new block']) == 0:
-					blockdict['start time'] = df['Time'][row]
-				blockdict['new block'].append(df[chamber][row])
-				blockdict['end time'] = df['Time'][row]
-		stats = pandas.DataFrame(outblock)
-		stats.to_csv(path_or_buf='{}/{}_ch{}.csv'.format(output, dataset, chamber), index=False, header=False)
+					blockdict['start time'] = times[row]
+				blockdict['new block'].append(rates[row])
+				blockdict['end time'] = times[row]
+		carried[str(chamber)] = {'count': count, 'state': state, 'start time': blockdict['start time'],
+			'end time': blockdict['end time'], 'new block': blockdict['new block']}
+		write_results('{}/{}_ch{}.csv'.format(output, dataset, chamber), pandas.DataFrame(outblock, dtype=object),
+			pandas.DataFrame(open_block, dtype=object), progress, header)
 
 
 def update_outblock(blockdict, count, outblock, alignment):
@@ -545,29 +1234,27 @@ def update_outblock(blockdict, count, outblock, alignment):
 	return blockdict, outblock
 
 
-def graph(intake, output, limits):
+def graph(intake, output, limits, subplots=False):
 	"""
-	Creates a scatter plot for each chamber's column from a defined data set csv with defined x and y limits.
+	Plans a scatter plot for each chamber's column from a defined data set csv with defined x and y limits.
+	The csv is read once, each plot gets only its chamber's columns.
 
 	:param intake: path to data
 	:param output: path for export
 	:param limits: x and y limits to use for graphs
+	:param subplots: plot all chambers as subplots of one figure
+	:return: list of graph tasks for render_graphs
 	"""
-	df = pandas.read_csv(intake, header=None, names=['Time',1,2,3,4,5,6,7,8])
-	for chamber in range(1, 9):
-		df.plot.scatter(x='Time', y=chamber)
-		# If x or y limits are not zero, then resize graph to the inputted limits
-		if limits[0] != limits[1]:
-			plt.xlim(limits[0], limits[1])
-		if limits[2] != limits[3]:
-			plt.ylim(limits[2], limits[3])
-		plt.savefig('{}/ch{}.png'.format(output, chamber))
-		plt.close()
+	df = load_csv(intake)
+	# chamber columns are renamed to strings, pandas reads integer column names as positions
+	panels = [(chamber, df[['Time', chamber]].rename(columns={chamber: str(chamber)}), 'Time', str(chamber), None)
+			for chamber in range(1, 9)]
+	return graph_tasks(panels, output, limits, subplots)
 
 
-def stats_graph(intake, output, limits, interval, prefix, sd, se):
+def stats_graph(intake, output, limits, interval, prefix, sd, se, subplots=False):
 	"""
-	Creates a scatter plot for each chamber's csv from a defined data set with defined x and y limits and error bars.
+	Plans a scatter plot for each chamber's csv from a defined data set with defined x and y limits and error bars.
 
 	:param intake: path to data
 	:param output: path for export
@@ -576,22 +1263,95 @@ def stats_graph(intake, output, limits, interval, prefix, sd, se):
 	:param prefix: prefix for block data files
 	:param sd: specifies standard deviation for error bars
 	:param se: specifies specifying standard error for error bars
+	:param subplots: plot all chambers as subplots of one figure
+	:return: list of graph tasks for render_graphs
 	"""
-	for chamber in range(1, 9):
-		df = pandas.read_csv('{}/{}_ch{}.csv'.format(intake, prefix, chamber), header=0)
-		if sd:
-			df.plot.scatter(x=interval, y='Mean', yerr='SD')
-		elif se:
-			df.plot.scatter(x=interval, y='Mean', yerr='SE')
-		else:
-			df.plot.scatter(x=interval, y='Mean')
+	yerr = None
+	if sd:
+		yerr = 'SD'
+	elif se:
+		yerr = 'SE'
+	panels = []
+	for chamber, df in read_stats(intake, prefix).items():
+		panels.append((chamber, df, interval, 'Mean', yerr))
+	return graph_tasks(panels, output, limits, subplots)
+
+
+def read_stats(intake, prefix):
+	"""
+	Reads the stats csv of every chamber, from the long format stats.csv if stats were written with --long.
+
+	:param intake: path to data
+	:param prefix: prefix for block data files
+	:return: dictionary of chamber to its stats data frame
+	"""
+	long_path = '{}/stats.csv'.format(intake)
+	if not prefix and os.path.exists(long_path):
+		df = pandas.read_csv(long_path, header=0)
+		return {chamber: df[df['Chamber'] == chamber] for chamber in range(1, 9)}
+	# hour stats are written without a prefix
+	name = '{}_ch{}.csv' if prefix else '{}ch{}.csv'
+	return {chamber: pandas.read_csv('{}/{}'.format(intake, name.format(prefix, chamber)), header=0) for chamber in range(1, 9)}
+
+
+def graph_tasks(panels, output, limits, subplots):
+	"""
+	Groups chamber panels into graph tasks, a figure per chamber or one figure of subplots.
+
+	:param panels: list of (chamber, data frame, x column, y column, error column or None)
+	:param output: path for export
+	:param limits: x and y limits to use for graphs
+	:param subplots: plot all chambers as subplots of one figure
+	:return: list of graph tasks, each a tuple of (path for export, panels, limits)
+	"""
+	if subplots:
+		return [('{}/chambers.png'.format(output), panels, limits)]
+	return [('{}/ch{}.png'.format(output, panel[0]), [panel], limits) for panel in panels]
+
+
+def render_graphs(tasks, jobs=0):
+	"""
+	Renders graph tasks, spread over a pool of worker processes.
+
+	:param tasks: list of graph tasks from graph and stats_graph
+	:param jobs: number of worker processes, 0 for one per core
+	"""
+	jobs = jobs or os.cpu_count() or 1
+	if jobs == 1 or len(tasks) <= 1:
+		for task in tasks:
+			render_graph(task)
+		return
+	with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+		# list() so an exception in any worker is raised here
+		list(pool.map(render_graph, tasks))
+
+
+def render_graph(task):
+	"""
+	Renders one graph task to a png, a scatter plot per panel.
+
+	:param task: tuple of (path for export, panels, limits)
+	"""
+	path, panels, limits = task
+	if len(panels) == 1:
+		chamber, df, x, y, yerr = panels[0]
+		df.plot.scatter(x=x, y=y, yerr=yerr)
+		axes = [plt.gca()]
+	else:
+		fig, axes = plt.subplots(2, (len(panels) + 1) // 2, figsize=(5 * ((len(panels) + 1) // 2), 8))
+		axes = axes.flatten()
+		for (chamber, df, x, y, yerr), ax in zip(panels, axes):
+			df.plot.scatter(x=x, y=y, yerr=yerr, ax=ax, title='Chamber {}'.format(chamber))
+	for ax in axes:
 		# If x or y limits are not zero, then resize graph to the inputted limits
 		if limits[0] != limits[1]:
-			plt.xlim(limits[0], limits[1])
+			ax.set_xlim(limits[0], limits[1])
 		if limits[2] != limits[3]:
-			plt.ylim(limits[2], limits[3])
-		plt.savefig('{}/ch{}.png'.format(output, chamber))
-		plt.close()
+			ax.set_ylim(limits[2], limits[3])
+	if len(panels) > 1:
+		plt.tight_layout()
+	plt.savefig(path)
+	plt.close('all')
 			
 
 def log_functions(args, paths, process_log):
@@ -619,4 +1379,5 @@ def log_functions(args, paths, process_log):
 		log_file.close()
 
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+	main()
@@ -17,11 +17,12 @@ INSTRUCTIONS
 import csv
 import argparse
 from datetime import datetime
-from numpy import array
 from configparser import ConfigParser
 import os
 import json
 
+import logaccess
+
 
 def main():
 	"""
@@ -43,6 +44,8 @@ def main():
 	parser.add_argument('-e', '--email', action='store_true', help='email media report (must set parameters inside code)')
 	parser.add_argument('-c', '--config', default='config.ini', help="change config file from default 'config.ini'")
 	parser.add_argument('-l', '--log', default='media.log', help="change exported media log file from 'media.log'")
+	parser.add_argument('--state', default='',
+						help="change file keeping the log offset and dilutions since the last report from '<media log>.state'")
 	parser.add_argument('-s', '--start', default='0', help='start program with new starting media amount in ml amount if no log file exists')
 	parser.add_argument('-r', '--report', action='store_true', help='program will report media whenever it run (specify time interval with crontab)')
 	parser.add_argument('-n', '--percent', default='0', help="specify percent limit when report wanted (e.g. '10' reports when 10%% of starting media is left)")
@@ -56,7 +59,8 @@ def main():
 		config.read(args.config)
 		config_log = dict(config.items('log'))
 
-		if (args.report or float(args.percent) > 0 or float(args.limit) > 0 or float(args.amount) > 0) and (args.print or len(args.email) > 1 or len(args.text) > 1):
+		state_path = args.state or args.log + '.state'
+		if (args.report or float(args.percent) > 0 or float(args.limit) > 0 or float(args.amount) > 0) and (args.print or args.email or len(args.text) > 1):
 			if os.path.exists(args.log):
 				# each media log entry occurs when there is a report and is formatted as such: 
 				#	[time and date, machine time, media starting amount in ml, ml of last report, ml of last --amount report, report message]
@@ -66,11 +70,12 @@ def main():
 				media_log.close()
 			else:
 				print('No media log file exists. Will create new one with starting amount specified from --start parameter.')
-				dilutions = parse_u(config_log, 0)
+				# media is counted from the start of the experiment
+				time_start = json.loads(logaccess.first_line(config_log['fulllog']))['timestamp']
 				media_log = open(args.log, 'a')
 				writer = csv.writer(media_log)
 				date_time = datetime.now().strftime("%Y-%m-%d %H:%M")
-				report = [date_time, dilutions[0][0], float(args.start), float(args.start), float(args.start), 'Starting media reporting at {} with {}ml of media.'.format(date_time, args.start), args.start]
+				report = [date_time, time_start, float(args.start), float(args.start), float(args.start), 'Starting media reporting at {} with {}ml of media.'.format(date_time, args.start), args.start]
 				writer.writerow(report)
 				media_log.close()
 			try:
@@ -78,19 +83,22 @@ def main():
 			except NameError:
 				print('First report made.')
 			else:
-				dilutions = parse_u(config_log, last_report[1])
-				decision, report_str, report = report_build(args, dilutions, last_report)
+				state = parse_u(config_log, last_report, read_state(state_path))
+				decision, report_str, report = report_build(args, state['total'], state['timestamp'], last_report)
 				if decision:
 					media_log = open(args.log, 'a')
 					writer = csv.writer(media_log)
 					writer.writerow(report)
 					media_log.close()
+					# the next report counts the dilutions from this one on
+					state.update({'report': report[1], 'total': 0.0})
 					if args.print:
 						print(report_str)
 					if len(args.text) > 1:
 						text_report(args.text, report_str)
-					if len(args.email) > 1:
+					if args.email:
 						email_report(args.text, report_str)
+				write_state(state_path, state)
 		else:
 			print('ERROR: Communication or reporting method not specified.')
 	else:
@@ -98,49 +106,80 @@ def main():
 	print('Media-Monitor.py end.\n')
 
 
-def parse_u(config_log, start_time):
+def parse_u(config_log, last_report, state):
 	"""
-	Parses dilution values from the log file.
+	Adds up the dilution values of the log file since the last media log report.
+	Only the records appended since the last run are decoded, the byte offset in the log and the running total are
+	kept in the state. Without a state for the last report (e.g. the first run) the whole log is read once.
 
-	:param rdata: full log file from config file
-	:param start_time: machine time of last media log report
-	:return: array of all dilution values
+	:param config_log: log variables from config file
+	:param last_report: last media report data
+	:param state: state of the last run, None if there is none
+	:return: state with the total dilutions since the last report and the machine time of the last record read
 	"""
-	logfile = open(config_log['fulllog'], 'r')  # open input file
-	logdata = logfile.readlines()
-	logfile.close()
-
-	data = []
-	for line in logdata:
-		if len(line) > 0:
+	start_time = float(last_report[1])
+	if state is None or state['fulllog'] != config_log['fulllog'] or state['report'] != start_time:
+		state = {'fulllog': config_log['fulllog'], 'report': start_time, 'offset': 0, 'total': 0.0, 'timestamp': start_time}
+	try:
+		lines, state['offset'] = logaccess.lines_from(config_log['fulllog'], state['offset'])
+	except ValueError:
+		# the log was replaced, count again from the last report
+		state.update({'total': 0.0, 'timestamp': start_time})
+		lines, state['offset'] = logaccess.lines_from(config_log['fulllog'], 0)
+	for line in lines:
+		if line.strip():
 			temp_data = json.loads(line)
 			if temp_data['timestamp'] > start_time:
-				data.append(temp_data['u'])
-	return data
+				state['total'] += float(sum(temp_data['u']))
+				state['timestamp'] = temp_data['timestamp']
+	return state
+
+
+def read_state(path):
+	"""
+	Reads the state kept between runs.
+
+	:param path: path to the state file
+	:return: state dictionary, None if there is no state file
+	"""
+	if not os.path.exists(path):
+		return None
+	with open(path, 'r') as state_file:
+		return json.load(state_file)
+
+
+def write_state(path, state):
+	"""
+	Saves the state for the next run, replacing the state file at once so it is never partly written.
+
+	:param path: path to the state file
+	:param state: state dictionary
+	"""
+	temp_path = '{}.{}.tmp'.format(path, os.getpid())
+	with open(temp_path, 'w') as state_file:
+		json.dump(state, state_file)
+	os.replace(temp_path, path)
 
 
-def report_build(args, udata, last_report):
+def report_build(args, total_dilutions, timestamp, last_report):
 	"""
 	Builds the media report and message from the dilution values and past report.
 
 	:param args: command line argument parameters for more customized reports
-	:param udata: matrix of dilution values since last report
+	:param total_dilutions: sum of dilution values since last report
+	:param timestamp: machine time of the last dilution values
 	:param last_report: last media report data
 	return: media report information as string and list
 	"""
 	decision = False
 	date_time = datetime.now().strftime("%Y-%m-%d %H:%M")
-	total_dilutions = 0
 	amount_interval = float(last_report[4])
-	udata = array(udata)
-	for row in udata:
-		total_dilutions += row[1:].sum()
 	current_amount = float(last_report[3]) - total_dilutions
 	local_percent = (total_dilutions // float(last_report[3]))*100
 	total_percent = (current_amount // float(last_report[2]))*100
-	report_str = "Current media level is at " + current_amount + "ml.\n" + \
-		"The experiment has consumed " + total_dilutions + "ml or " + local_percent + "% since the last report.\n" + \
-		"Total media level is at " + total_percent + "% of the starting amount of " + last_report[2] + "ml."
+	report_str = "Current media level is at " + str(current_amount) + "ml.\n" + \
+		"The experiment has consumed " + str(total_dilutions) + "ml or " + str(local_percent) + "% since the last report.\n" + \
+		"Total media level is at " + str(total_percent) + "% of the starting amount of " + last_report[2] + "ml."
 	if args.report:
 		decision = True
 	if float(args.amount) > 0:
@@ -153,10 +192,10 @@ def report_build(args, udata, last_report):
 			report_str += "\nThe media limit of " + args.limit + "ml has been reached."
 			decision = True
 	if float(args.percent) > 0:
-		if total_percent <= float(args.args.percent):
+		if total_percent <= float(args.percent):
 			report_str += "\nThe percent limit of " + args.percent + "% has been reached."
 			decision = True
-	report = [date_time, udata[-1][0], last_report[2], current_amount, amount_interval, report_str]
+	report = [date_time, timestamp, last_report[2], current_amount, amount_interval, report_str]
 	return decision, report_str, report
 
 
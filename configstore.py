@@ -0,0 +1,276 @@
+"""Conflict safe updates of the config file shared by several processes.
+
+The controller reads config.ini while Block-Dilutions (and the network
+setpoint command) change it. Every write goes to a temporary file that
+is renamed over config.ini, so a reader always sees either the old or
+the new file, never a partly written one. Each write also increases a
+version counter kept in the file itself:
+
+    [configstore]
+    version = 12
+
+An update names the version it was computed from and is refused if
+another process wrote in the meantime (compare and swap), so a setpoint
+computed from a stale config is never written. Writers only hold a lock
+for the moment of the write; readers never lock.
+
+Only the lines of the options that change (and the version line) are
+rewritten, so comments, the case of option names, the order of the
+file and its line endings are kept as the user wrote them.
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+try:
+    from ConfigParser import RawConfigParser
+except ImportError:
+    from configparser import RawConfigParser
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows); writes are still atomic.
+    fcntl = None
+
+SECTION = 'configstore'
+
+# The section header and option lines RawConfigParser accepts.
+_SECTION_LINE = re.compile(r'\[(?P<name>[^]]+)\]')
+# (matched without the line ending, an empty value must not take it into sep)
+_OPTION_LINE = re.compile(r'(?P<key>[^:=\s][^:=]*?)(?P<sep>[ \t]*[:=][ \t]*)(?P<value>.*)$')
+
+# os.rename does not replace an existing file on Windows.
+_replace = getattr(os, 'replace', os.rename)
+
+
+class ConfigConflict(Exception):
+    """An update kept conflicting with writes of other processes."""
+
+
+def read_config(filename):
+    """Parse filename without interpolation.
+
+    Returns:
+        tuple (version, sections): the version counter (0 for a file the
+        store never wrote) and an OrderedDict of section name to
+        OrderedDict of its items, in file order.
+
+    Raises:
+        IOError if the file can not be read.
+    """
+    return parse_config(read_text(filename))
+
+
+def read_text(filename):
+    """The text of filename, line endings untouched."""
+    with open(filename, 'rb') as f:
+        text = f.read()
+    if not isinstance(text, str):
+        text = text.decode('utf-8')
+    return text
+
+
+def parse_config(text):
+    """Parse the text of a config file. Returns (version, sections)."""
+    config = RawConfigParser()
+    getattr(config, 'read_file', getattr(config, 'readfp', None))(
+        StringIO(text))
+    sections = OrderedDict((name, OrderedDict(config.items(name)))
+                           for name in config.sections())
+    version = int(sections.get(SECTION, {}).get('version', 0))
+    return version, sections
+
+
+def set_options(text, changes):
+    """Set options in the text of a config file.
+
+    The line of each option that is set is rewritten in place (keeping
+    its name and separator as written), options missing from their
+    section are added at its end and missing sections at the end of the
+    text. Every other line is left alone.
+
+    Args:
+        text: text of the config file.
+        changes: dict of section name to dict of items to set.
+
+    Returns:
+        the new text.
+
+    Example (an empty value is filled in on the line of its option):
+        >>> text = set_options('[controller]\\nsavesetpoint = \\nkp: 3\\n',
+        ...                    {'controller': {'savesetpoint': '0.3 0.3'}})
+        >>> text
+        '[controller]\\nsavesetpoint = 0.3 0.3\\nkp: 3\\n'
+        >>> parse_config(text)[1]['controller']['savesetpoint']
+        '0.3 0.3'
+    """
+    lines = text.splitlines(True)
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += newline
+    pending = OrderedDict((name.strip(), OrderedDict(
+        (key.lower(), (key, str(value))) for key, value in items.items()))
+        for name, items in changes.items())
+    out = []
+    section = None
+    end = 0  # where to add missing options of the current section
+    replaced = False  # skipping continuation lines of a replaced value
+    for line in lines:
+        stripped = line.strip()
+        if replaced and stripped and line[0] in ' \t':
+            continue
+        replaced = False
+        match = _SECTION_LINE.match(line)
+        if match:
+            _add_missing(out, end, pending.get(section), newline)
+            section = match.group('name').strip()
+            out.append(line)
+            end = len(out)
+            continue
+        match = _OPTION_LINE.match(line.rstrip('\r\n'))
+        if (match and not stripped.startswith((';', '#'))
+                and line[0] not in ' \t'):
+            key = match.group('key').rstrip().lower()
+            items = pending.get(section)
+            if items is not None and key in items:
+                value = items.pop(key)[1]
+                ending = line[len(line.rstrip('\r\n')):]
+                line = '%s%s%s%s' % (match.group('key'),
+                                     match.group('sep'), value, ending)
+                replaced = True
+        out.append(line)
+        if stripped:
+            end = len(out)
+    _add_missing(out, end, pending.get(section), newline)
+    for name, items in pending.items():
+        if items:
+            if out and out[-1].strip():
+                out.append(newline)
+            out.append('[%s]%s' % (name, newline))
+            _add_missing(out, len(out), items, newline)
+    return ''.join(out)
+
+
+def _add_missing(out, end, items, newline):
+    # Insert the options still in items after line end of out, then
+    # forget them.
+    if not items:
+        return
+    out[end:end] = ['%s = %s%s' % (key, value, newline)
+                    for key, value in items.values()]
+    items.clear()
+
+
+def write_text(filename, text):
+    """Atomically replace filename with text.
+
+    The new file is written and flushed to disk under a temporary name
+    next to filename, then renamed over it.
+    """
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, filename)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class ConfigStore(object):
+    """Versioned reads and compare and swap writes of one config file.
+
+    Attributes:
+        version: version of the last read or write by this store.
+        sections: sections of the last read or write by this store.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lockname = filename + '.lock'
+        self.version = None
+        self.sections = None
+
+    def read(self):
+        """Read the file. Returns (version, sections), see read_config."""
+        self.version, self.sections = read_config(self.filename)
+        return self.version, self.sections
+
+    def compareAndSwap(self, version, changes):
+        """Apply changes if the file is still at version.
+
+        Args:
+            version: the version the changes were computed from.
+            changes: dict of section name to dict of items to set. Items
+                and sections not named are kept as they are in the file.
+
+        Returns:
+            the new version, or None if the file is no longer at version
+            (nothing is written).
+        """
+        lock = self._lock()
+        try:
+            text = read_text(self.filename)
+            current, sections = parse_config(text)
+            if current != version:
+                return None
+            changes = dict(changes)
+            changes[SECTION] = {'version': current + 1}
+            text = set_options(text, changes)
+            write_text(self.filename, text)
+            sections = parse_config(text)[1]
+        finally:
+            self._unlock(lock)
+        self.version, self.sections = current + 1, sections
+        return self.version
+
+    def update(self, function, retries=5):
+        """Read, modify and write, retrying when another process wrote first.
+
+        Args:
+            function: called with the sections of a fresh read, returns
+                the changes to write (see compareAndSwap), or None for
+                no change.
+            retries: number of attempts.
+
+        Returns:
+            the version of the file after the update.
+
+        Raises:
+            ConfigConflict if every attempt conflicted.
+        """
+        for _ in range(retries):
+            version, sections = self.read()
+            changes = function(sections)
+            if not changes:
+                return version
+            new_version = self.compareAndSwap(version, changes)
+            if new_version is not None:
+                return new_version
+        raise ConfigConflict('%s kept changing, update not written'
+                             % self.filename)
+
+    def _lock(self):
+        # Serializes writers only, for the few milliseconds of a write.
+        if fcntl is None:
+            return None
+        f = open(self.lockname, 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    def _unlock(self, f):
+        if f is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            f.close()
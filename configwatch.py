@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import traceback
+
+try:
+    from ConfigParser import SafeConfigParser as ConfigParser, Error as ConfigError
+except ImportError:
+    from configparser import ConfigParser, Error as ConfigError
+
+
+# Controller parameters that must parse as numbers when present.
+NUMERIC_KEYS = ('ki', 'kp', 'maxdilution', 'mindilution', 'period')
+# Controller parameters holding one number per chamber.
+CHAMBER_KEYS = ('setpoint', 'altsetpoint', 'savesetpoint', 'blockstart')
+
+
+class FrozenDict(dict):
+    """A dict that can not be modified after construction."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('config snapshots are read only')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+class ConfigSnapshot(object):
+    """Immutable parsed contents of the config file.
+
+    Attributes:
+        version: increases by one every time a new snapshot is published.
+        mtime: modification time of the file the snapshot was parsed from.
+        sections: FrozenDict of section name to FrozenDict of its items.
+    """
+
+    __slots__ = ('version', 'mtime', 'sections')
+
+    def __init__(self, version, mtime, sections):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'mtime', mtime)
+        object.__setattr__(self, 'sections', FrozenDict(
+            (name, FrozenDict(items)) for name, items in sections.items()))
+
+    def __setattr__(self, name, value):
+        raise TypeError('config snapshots are read only')
+
+    def section(self, name):
+        return self.sections[name]
+
+
+def parse_config(filename):
+    """Parse filename into a dict of section name to dict of items."""
+    config = ConfigParser()
+    if not config.read(filename):
+        raise IOError('could not read %s' % filename)
+    return dict((name, dict(config.items(name)))
+                for name in config.sections())
+
+
+def validate(sections, previous=None):
+    """Check that a parsed config is usable by the controller.
+
+    A config caught half way through being rewritten usually fails these
+    checks, so it is never published.
+
+    Args:
+        sections: output of parse_config.
+        previous: the snapshot currently in use, if any. Per chamber values
+            must keep the same number of chambers.
+
+    Raises:
+        ValueError describing the first problem found.
+    """
+    if 'controller' not in sections:
+        raise ValueError('no [controller] section')
+    cparams = sections['controller']
+    if 'setpoint' not in cparams:
+        raise ValueError('no setpoint in [controller]')
+    for key in NUMERIC_KEYS:
+        if key in cparams:
+            float(cparams[key])
+    nchambers = None
+    if previous is not None:
+        nchambers = len(previous.section('controller')['setpoint'].split())
+    for key in CHAMBER_KEYS:
+        if not cparams.get(key, '').strip():
+            continue
+        values = [float(v) for v in cparams[key].split()]
+        if nchambers is None:
+            nchambers = len(values)
+        elif len(values) != nchambers:
+            raise ValueError('%s has %d values, expected %d'
+                             % (key, len(values), nchambers))
+
+
+class ConfigWatcher(threading.Thread):
+    """Watches the config file and publishes a new snapshot when it changes.
+
+    The file is only parsed when its modification time or size changes, and
+    a snapshot is only published once it validates. Readers just take
+    watcher.snapshot; replacing that attribute is atomic, so they never
+    block the watcher or each other.
+
+    Callbacks added with subscribe() run in the watcher thread with the new
+    snapshot.
+    """
+
+    def __init__(self, filename, poll=1.0):
+        """Initialize the watcher and parse the file once.
+
+        Args:
+            filename: path of the config file.
+            poll: seconds between checks of the file's modification time.
+
+        Raises:
+            IOError or ValueError if the initial config is not usable.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.poll = float(poll)
+        self._stop_event = threading.Event()
+        self._callbacks = []
+        self._stat = self._statFile()
+        self._bad_stat = None
+        sections = parse_config(filename)
+        validate(sections)
+        self.snapshot = ConfigSnapshot(1, self._stat[0], sections)
+
+    def _statFile(self):
+        st = os.stat(self.filename)
+        # The inode changes whenever the file is replaced by a rename, which
+        # catches rewrites that keep the size within the mtime resolution.
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def subscribe(self, cb):
+        self._callbacks.append(cb)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def check(self):
+        """Reparse the file if it changed. Returns True if a snapshot was published."""
+        try:
+            stat = self._statFile()
+        except OSError:
+            # The file may be briefly missing while it is being replaced.
+            return False
+        if stat == self._stat or stat == self._bad_stat:
+            return False
+        try:
+            sections = parse_config(self.filename)
+            validate(sections, self.snapshot)
+        except (IOError, ValueError, KeyError, ConfigError) as e:
+            # Try again once the file changes again; a writer may be mid
+            # way through.
+            print('config %s not applied: %s' % (self.filename, e))
+            self._bad_stat = stat
+            return False
+        self._stat = stat
+        self.snapshot = ConfigSnapshot(self.snapshot.version + 1, stat[0],
+                                       sections)
+        for cb in self._callbacks:
+            try:
+                cb(self.snapshot)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+        return True
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.check()
+            self._stop_event.wait(self.poll)
@@ -1,13 +1,19 @@
 ##### THIS CODE DEFINES THE OBJECT CONTROLLER TO BE USED IN OTHER CODE WITH SPECIFIC DIRECTIONS####
 
-from numpy import array, ones #Array creates arrays, a data type that is like a more restricted list (https://docs.python.org/2/library/array.html)
+from numpy import array #Array creates arrays, a data type that is like a more restricted list (https://docs.python.org/2/library/array.html)
 																									#(https://docs.scipy.org/doc/numpy/reference/generated/numpy.array.html)
-								#Ones creats an array of the specified dimensions full of 1s (https://docs.scipy.org/doc/numpy/reference/generated/numpy.ones.html)
-from mytimer import mytimer # imports mytimer fucntion from mytimer.py
-from math import log10 #Log10 function
+from mytimer import Scheduler # monotonic scheduler for periodic jobs, from mytimer.py
+from logwriter import LogWriter # background writer for odlog and fulllog
+from serialreader import SerialReader # blocking reader for the controller serial port
+from odengine import ODEngine, split_readings # vectorized OD computation against the blank
+from dispense import DispenseScheduler # plans and times the dilutions of each period
+from snapshot import ControllerSnapshot, SnapshotBoard # read only state of recent cycles
+from ringbuffer import SampleRing # fixed size buffer of raw tx/rx samples
 from time import time, sleep #Time.time() gives you the time. time.sleep(secs) causes the program to sleep for the goven number of seconds. 
 							#(https://docs.python.org/2/library/time.html)
-from ConfigParser import SafeConfigParser #Configuration file parser (https://docs.python.org/2/library/configparser.html)
+from controlparams import ControlParams # [controller] values parsed once per config change
+from configwatch import ConfigWatcher # publishes parsed config.ini snapshots when the file changes
+from configstore import ConfigStore # atomic, versioned (compare and swap) writes of config.ini
 
 import json #Javascript object notation (https://docs.python.org/2/library/json.html)
 import threading #constructs higher-level threading interfaces on top of the lower level thread module. (https://docs.python.org/2/library/threading.html)
@@ -42,47 +48,82 @@ class Controller(object): #define new object type
 		_temp = __import__(control_function_package, globals(), locals(),
 						   ['computeControl'], -1)
 		self.computeControl = types.MethodType(_temp.computeControl, self)
+		# Plugins may also provide a vectorized entry point for all chambers.
+		self.computeControlBatch = None
+		if hasattr(_temp, 'computeControlBatch'):
+			self.computeControlBatch = types.MethodType(
+				_temp.computeControlBatch, self)
 
 		#self.ser_lock = cport.lock
 		self.stdout_lock = threading.RLock()
 
 		# Make the pump driver as appropriate.
 		self.pump = pumpdriver.Pump(cparams, logfiles, pparams, cport, pport)
+		# Plans and runs the valve moves and pump strokes of each period.
+		self.dispenser = DispenseScheduler(cport, self.pump, pparams,
+										   self.stdout_lock)
+		self.last_dispense = None
 
-		# Config filename from servostat
+		# Config filename from servostat. The watcher only reparses it when
+		# it changes; controlLoop picks up each new validated snapshot.
 		self.config_filename = config_filename
+		self.config_watcher = ConfigWatcher(config_filename,
+											float(cparams.get('configpoll', 1.0)))
+		self.config_version = self.config_watcher.snapshot.version
+		# Setpoint changes are written through the store, so they never
+		# overwrite a concurrent change by Block-Dilutions or get torn.
+		self.config_store = ConfigStore(config_filename)
 
 		# Data from config.ini
 		self.logfiles = logfiles
 		self.pparams = pparams
 		self.cparams = cparams # all controller parameters live here
+		self.params = ControlParams(cparams) # the same, parsed for plugins
 		self.blank_filename = self.logfiles['blanklog']
 
+		# odlog and fulllog stay open and are written from a background thread
+		# so the serial and control threads never wait on the disk.
+		self.logwriter = LogWriter.fromConfig(logfiles)
+
 		# Serial ports
 		self.serpt = cport
 		self.pport = pport
 
-		# This lock is for the following tx/rx raw values.
 		# TODO: should the controller know the number of chambers
 		# in advance of measuring?
-		self.OD_datalock = threading.RLock()
-		self.tx_blank = []
-		self.rx_blank = []
-		self.rx_val = []
-		self.tx_val = []
+		self.od_engine = ODEngine() # holds the blank tx/rx arrays
+		# Raw interleaved tx/rx samples, reduced once per control period with
+		# odreducer (mean, median or trimmed; mean by default).
+		# The ring buffer has its own lock (od_samples.lock).
+		self.od_samples = SampleRing(int(cparams.get('odsamples', 256)))
+		self.od_reducer = cparams.get('odreducer', 'mean')
 		self.z = []
 
+		# Read only snapshots of the latest cycles, for the network port
+		# (historylength cycles are kept), and callbacks for each new
+		# fulllog line (servostat streams them to network clients).
+		self.snapshots = SnapshotBoard(int(cparams.get('historylength', 1440)))
+		self.cycle = 0
+		self.listeners = []
+		# Chambers (1 indexed) excluded at runtime, on top of exclude.txt.
+		# Kept in memory only: they are lost when the controller restarts.
+		self.excluded = set()
+
 		# Make sure to close all the pinch valves at startup.
 		with self.serpt.lock:
 			print 'Closing all valves;'
 			self.serpt.write("clo;")
 
-		# Construct the timer threads that perform repeated actions.
-		# TODO: make serial check period configurable.
+		# Construct the threads that perform repeated actions.
+		# The serial reader parses each line as soon as it arrives.
 		self.start_time = None  # Set on call to start()
-		control_period = int(cparams['period'])
-		self.cont_timer = mytimer(control_period, self.controlLoop)
-		self.ser_timer = mytimer(2, self.serialCheck)
+		# overrunpolicy decides what happens when a control loop runs past
+		# the next period: skip (default), catchup or coalesce.
+		self.control_period = int(cparams['period'])
+		self.scheduler = Scheduler()
+		self.overrun_policy = cparams.get('overrunpolicy', 'skip')
+		self.cont_job = None  # timing statistics, set on call to start()
+		self.ser_reader = SerialReader(self.serpt, self.parseline)
 
 	def start(self):
 		"""Starts the controller.
@@ -90,29 +131,68 @@ class Controller(object): #define new object type
 		So you can construct one without starting all the threads...
 		"""
 		assert self.start_time is None, 'Already started!'
+		assert self.serpt, 'ServoStat control serial port not initialized!'
 		self.start_time = time()
-		self.cont_timer.start()
-		self.ser_timer.start()
+		self.logwriter.start()
+		self.config_watcher.start()
+		self.cont_job = self.scheduler.add(self.control_period,
+										   self.controlLoop,
+										   self.overrun_policy, 'control')
+		self.scheduler.start()
+		self.ser_reader.start()
 
 	def quit(self):
 		"""Quit the controller."""
 		assert self.start_time is not None, 'Can\'t quit something you\'ve not started.'
-		self.cont_timer.stop()
-		self.ser_timer.stop()
+		self.scheduler.stop()
+		self.ser_reader.stop()
+		self.config_watcher.stop()
+		if not self.logwriter.close():
+			with self.stdout_lock:
+				print 'log writer did not stop, the last lines may be lost'
+		if self.logwriter.dropped:
+			with self.stdout_lock:
+				print 'log writer dropped %d lines' % self.logwriter.dropped
+
+	def setSetpoints(self, setpoints):
+		"""Change the setpoints of the running controller.
+
+		The change is saved to config.ini, so other programs sharing it
+		(Block-Dilutions) see it too.
+
+		Args:
+			setpoints: list of setpoints, one per chamber.
 
-	def serialCheck(self):
-		"""Reads data from the serial port.
+		Raises:
+			ValueError if there is not one number per chamber.
+			IOError or ConfigConflict if config.ini could not be updated.
+		"""
+		setpoints = [float(v) for v in setpoints]
+		if len(setpoints) != self.params.nchambers:
+			raise ValueError('expected %d setpoints, got %d' % (
+				self.params.nchambers, len(setpoints)))
+		setpoint = ' '.join(str(v) for v in setpoints)
+		self.config_store.update(
+			lambda sections: {'controller': {'setpoint': setpoint}})
+		cparams = dict(self.cparams)
+		cparams['setpoint'] = setpoint
+		params = ControlParams(cparams)
+		# Replace whole objects so readers never see a half updated one.
+		self.cparams, self.params = cparams, params
+		with self.stdout_lock:
+			print 'Set points updated'
 
-		Called in a thread every N seconds.
+	def exclude(self, chambers):
+		"""Dilute chambers (1 indexed) at a fixed rate until restart.
+
+		Unlike exclude.txt the exclusion is not saved, it only lasts until
+		the controller restarts.
 		"""
-		# Serial port better be initialized
-		assert self.serpt, 'ServoStat control serial port not initialized!'
+		self.excluded = self.excluded | set(int(c) for c in chambers)
 
-		# No need for lock:
-		# This runs in the only thread that READS self.serpt
-		while self.serpt.inWaiting() > 0:
-			line = self.serpt.readline().strip()
-			self.parseline(line)
+	def include(self, chambers):
+		"""Undo exclude() for chambers (1 indexed)."""
+		self.excluded = self.excluded - set(int(c) for c in chambers)
 
 	def parseOD(self, line):
 		"""Helper that parses OD data from a line off the serial port.
@@ -126,22 +206,16 @@ class Controller(object): #define new object type
 		data = map(int, line.split())
 
 		# Data line format: tx1 rx1 tx2 rx2
-		#TODO: file can stay open in append mode if I can figure out
-		#      how to guarentee they're allowed to be shared.
-		f = open(self.logfiles['odlog'], 'a')
 		time_str = str(int(round(time())))
 		str_data = map(str, data)
 		output_s = '%s %s' % (time_str, ' '.join(str_data))
-		f.write(output_s + '\n')
-		f.close()
+		self.logwriter.write('odlog', output_s)
 
 		with self.stdout_lock:
 			print output_s
 
-		# Stores all reported data locally in 2D matrix
-		with self.OD_datalock:
-			self.tx_val.append(data[0::2])
-			self.rx_val.append(data[1::2])
+		# Stores all reported data locally in the ring buffer
+		self.od_samples.append(data)
 
 	def parseline(self, line):
 		"""Parses a line from the serial port.
@@ -167,31 +241,6 @@ class Controller(object): #define new object type
 				print 'bad line:', line
 			return
 
-	def computeOD(self, btx, brx, tx, rx):
-		"""Compute the OD from blank values and signal values.
-
-		Args:
-			btx: blank transmitted light value.
-			brx: blank reflected light value.
-			tx: current transmitted light value.
-			rx: current reflected light value.
-
-		Returns:
-			Calculated optical density for the current values.
-		"""
-		# If either value is 0 then return 0. Since the proper behavior in an
-		# error is to do nothing.
-		# NOTE: later versions of this code should probably return None or
-		#       throw an exception since the error should probably be handled
-		#       by code higher up in the call stack.
-		if tx == 0 or rx == 0 or brx == 0 or btx == 0:
-			return 0
-
-		blank = float(brx) / float(btx)
-		measurement = float(rx) / float(tx)
-		od = log10(blank/measurement)
-		return od
-
 	def controlLoop(self):
 		"""Main loop of control.
 		  The plan:
@@ -200,72 +249,85 @@ class Controller(object): #define new object type
 			* compute control value
 			* do dilution (control valves and pumps)
 		"""
-		# Update cparams
-		with self.stdout_lock:
-			config = SafeConfigParser()
-			config.read(self.config_filename)
-			temp_cparams = dict(config.items('controller'))
-			if not temp_cparams['setpoint'] == self.cparams['setpoint']:
-				self.cparams = temp_cparams
-				print 'Set points updated'
-
-		# Averages down columns of 2D matrix for best estimate
-		with self.OD_datalock:
-			tx = map(int,array(self.tx_val).mean(axis=0)))
-			rx = map(int,array(self.rx_val).mean(axis=0)))
-			self.tx_val = []
-			self.rx_val = []
+		# Update cparams if the watcher published a new config snapshot.
+		# Taking the snapshot is a single attribute read; no lock needed.
+		snapshot = self.config_watcher.snapshot
+		if snapshot.version != self.config_version:
+			temp_cparams = snapshot.section('controller')
+			setpoint_changed = temp_cparams['setpoint'] != self.cparams['setpoint']
+			self.cparams = temp_cparams
+			self.params = ControlParams(temp_cparams)
+			self.config_version = snapshot.version
+			with self.stdout_lock:
+				print 'Config updated (version %d)' % snapshot.version
+				if setpoint_changed:
+					print 'Set points updated'
+
+		# Reduces down columns of the period's samples for best estimate.
+		# The ring buffer only swaps buffers under its lock.
+		tx, rx = split_readings(
+			self.od_samples.reduce(self.od_reducer).astype(int))
 
 		if len(rx) == 0 or len(tx) == 0:
 			# Have no measurements yet
 			return
 
-		if len(self.tx_blank) == 0 or len(self.rx_blank) == 0:
+		if not self.od_engine.hasBlank():
 			try:
-				# TODO: Make this parsing a helper.
-				bf = open(self.blank_filename, 'r')
-				blank_values = map(int, bf.readline().split())
-				self.tx_blank = blank_values[0::2]
-				self.rx_blank = blank_values[1::2]
-			except:
+				self.od_engine.loadBlank(self.blank_filename)
+			except (IOError, ValueError):
 				# No blank.dat file. Use the most recent measurement.
-				self.rx_blank = rx
-				self.tx_blank = tx
-
-				with open(self.blank_filename, 'w') as bf:
-					# Interleave tx and rx
-					flat_blank = [str(j) for i in zip(self.tx_blank, self.rx_blank)
-						for j in i];
-					bfstring = ' '.join(flat_blank)
-					bf.write('%s\n' % bfstring)
+				self.od_engine.setBlank(tx, rx)
+				self.od_engine.saveBlank(self.blank_filename)
 
 			# Setup z when blanking
-			self.z = [None] * len(self.rx_blank)
+			self.z = [None] * len(self.od_engine.brx)
 
 		# Compute control
 		# TODO: number of chambers should be configurable, no?
-		ods = map(self.computeOD, self.tx_blank,
-				  self.rx_blank, tx, rx)
-		cont = map(self.computeControl, ods, self.z, range(8),
-				   [time()-self.start_time]*len(self.z))
-
-		#u = [q[0] for q in cont]
-		#self.z = [q[1] for q in cont]
-		# Separate u lists from z
-		contT = zip(*cont) #transpose cont values [([u1,u2],z),([u1,u2],z),...]
-		u = array(contT[0]).transpose() #u=array([[u1,u1,u1,...],[u2,u2,u2,...]])
-		self.z = contT[1]
+		ods = self.od_engine.compute(tx, rx).tolist()
+		t = time()-self.start_time
+		if self.computeControlBatch is not None:
+			# One vectorized call: u=array([[u1,u2,...]]), z a list per chamber
+			u, self.z = self.computeControlBatch(array(ods), self.z, t)
+		else:
+			cont = map(self.computeControl, ods, self.z, range(len(ods)),
+					   [t]*len(self.z))
+
+			#u = [q[0] for q in cont]
+			#self.z = [q[1] for q in cont]
+			# Separate u lists from z
+			contT = zip(*cont) #transpose cont values [([u1,u2],z),([u1,u2],z),...]
+			u = array(contT[0]).transpose() #u=array([[u1,u1,u1,...],[u2,u2,u2,...]])
+			self.z = contT[1]
 
 
 		# Set excluded chambers to dilute at 11 units/chamber
+		# (from exclude.txt and from the network 'exclude' command)
+		exvals = set(self.excluded)
 		try:
 			exf = open('exclude.txt','r')
-			exvals = map(int,exf.readline().split())
+			exvals.update(map(int,exf.readline().split()))
 			exf.close()
-			for ee in exvals:
-				u[:,ee-1] = u[:,ee-1]+11
 		except:
 			pass
+		for ee in exvals:
+			if 1 <= ee <= u.shape[1]:
+				u[:,ee-1] = u[:,ee-1]+11
+
+		# Plan this period's valve moves and pump strokes, skipping chambers
+		# with nothing to dispense, and start selecting the media valve.
+		plan = self.dispenser.plan(u)
+		self.last_dispense = plan
+		if plan.predicted > self.control_period:
+			with self.stdout_lock:
+				print 'WARNING: dispense plan needs %.1fs, period is %ds' % (
+					plan.predicted, self.control_period)
+		try:
+			self.dispenser.begin(plan)
+		except AttributeError, e:
+			with self.stdout_lock:
+				print 'no pump', e
 
 		# Log events
 		print 'Logging data.'
@@ -276,64 +338,44 @@ class Controller(object): #define new object type
 				'z': [str(z) for z in self.z]}
 		log_str = json.dumps(dlog)
 
-		with open(self.logfiles['fulllog'], 'a') as f:
-			f.write('%s\n' % log_str)
+		self.logwriter.write('fulllog', log_str)
+		self.cycle += 1
+		self.snapshots.publish(ControllerSnapshot(
+			cycle=self.cycle, timestamp=time_secs, ods=dlog['ods'],
+			u=dlog['u'], z=dlog['z'],
+			setpoint=self.params.setpoint.tolist(),
+			excluded=sorted(exvals),
+			blank_tx=self.od_engine.btx.tolist(),
+			blank_rx=self.od_engine.brx.tolist(),
+			dispense_predicted=plan.predicted))
+		for listener in self.listeners:
+			try:
+				listener(log_str)
+			except Exception:
+				traceback.print_exc(file=sys.stdout)
 
 		with self.stdout_lock:
 			print log_str
-
-		# Handle dispensing.
+			if self.ser_reader.lines:
+				print 'serial latency: last %.3fs mean %.3fs max %.3fs' % (
+					self.ser_reader.latency_last,
+					self.ser_reader.latency_mean(),
+					self.ser_reader.latency_max)
+			if self.cont_job is not None:
+				print 'control timing: jitter %.3fs max %.3fs, %d overruns, %d missed' % (
+					self.cont_job.jitter_last, self.cont_job.jitter_max,
+					self.cont_job.overruns, self.cont_job.missed)
+
+		# Dispense: sel0 was sent before logging, so the media valve settled
+		# while the data was written out.
 		try:
-			with self.serpt.lock:
-				self.serpt.write("sel0;") # Select media source
-			print 'sel0;'
-			sleep(0.5)
-
-			# TODO: parameterize antibacklash, now 100
-			overdraw_volume = 100
-			overdraw = ones((u.shape[0], 1)) * overdraw_volume
-			if self.pparams['roundingfix'].lower() != 'true':
-				amt_withdraw = u.sum(axis=1) + overdraw_volume
-				self.pump.withdraw(amt_withdraw)
-				self.pump.waitForPumping()
-			else:
-				#withdraw each volume sepparately so when we dispense sepparetly
-				# the rounding errors cancel out
-				for amt_withdraw in u.transpose():
-					self.pump.withdraw(amt_withdraw)
-					self.pump.waitForPumping()
-				#withdraw some extra to take care of backlash
-				self.pump.withdraw(overdraw)
-				self.pump.waitForPumping()
-
-			self.pump.dispense(overdraw)
-			self.pump.waitForPumping()
-
-			# dispvals gets a tuple of dispense volumes for chamber_num
-			chamber_num = 1
-			for dispvals in u.transpose():
-				selstr = "sel%s;" % chamber_num
-				# If we're moving from PV1 to PV2 then close first
-				# to prevent leaks into tube 5; i.e. so no two are open at once
-				if chamber_num == 5:
-					with self.serpt.lock:
-						self.serpt.write("clo;")
-					sleep(2)
-				with self.serpt.lock:
-					self.serpt.write(selstr) #select chamber
-				print selstr #for debug
-				sleep(1.0)  #give PV time to move, SPV needs ~100ms, servo 1s
-
-				print 'dispensing', dispvals, 'into chamber', chamber_num
-				self.pump.dispense(dispvals)
-				self.pump.waitForPumping()
-
-				chamber_num = chamber_num + 1
-
-			with self.serpt.lock:
-				self.serpt.write("clo;")
-#                self.serpt.flush()
-			print 'clo;'
+			actual = self.dispenser.execute(plan)
+			with self.stdout_lock:
+				print 'dispense cycle: predicted %.1fs, actual %.1fs' % (
+					plan.predicted, actual)
+				if actual > self.control_period:
+					print 'WARNING: dispensing took longer than the %ds period' % (
+						self.control_period)
 
 		except AttributeError, e:
 			with self.stdout_lock:
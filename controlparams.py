@@ -0,0 +1,49 @@
+import numpy
+
+
+def _float(cparams, key):
+    value = cparams.get(key, '')
+    if not str(value).strip():
+        return None
+    return float(value)
+
+
+def _floats(cparams, key):
+    value = cparams.get(key, '')
+    if not str(value).strip():
+        return None
+    return numpy.array([float(v) for v in value.split()])
+
+
+class ControlParams(object):
+    """The [controller] parameters parsed into numbers, for control plugins.
+
+    Built once per config change by the controller and available to plugins
+    as self.params, so computeControl does not parse strings for every
+    chamber on every period. Keys that are missing or empty in the config
+    are None.
+
+    Attributes:
+        setpoint: array of setpoints, one per chamber.
+        altsetpoint: array of alternate setpoints (turbidostatControllerSQ).
+        ki, kp: integral and proportional gains.
+        mindilution, maxdilution: bounds on the dilution.
+        odperiod: hours per setpoint/altsetpoint cycle (turbidostatControllerSQ).
+        period: control period in seconds.
+        nchambers: number of chambers, from the setpoint.
+    """
+
+    def __init__(self, cparams):
+        """Initialize from a dictionary of [controller] strings."""
+        self.setpoint = _floats(cparams, 'setpoint')
+        self.altsetpoint = _floats(cparams, 'altsetpoint')
+        self.ki = _float(cparams, 'ki')
+        self.kp = _float(cparams, 'kp')
+        self.mindilution = _float(cparams, 'mindilution')
+        self.maxdilution = _float(cparams, 'maxdilution')
+        self.odperiod = _float(cparams, 'odperiod')
+        self.period = _float(cparams, 'period')
+        if self.setpoint is None:
+            self.nchambers = 0
+        else:
+            self.nchambers = len(self.setpoint)
@@ -0,0 +1,186 @@
+from numpy import ones
+from time import time, sleep
+
+import threading
+
+
+class Step(object):
+    """One action of a dispense plan.
+
+    kind is 'valve' (send cmd to the controller board, then let the valves
+    settle for settle seconds) or 'withdraw'/'dispense' (move the pump by
+    volume, an array with one value per pump).
+    predicted is the expected duration of the step in seconds.
+    """
+
+    def __init__(self, kind, cmd=None, volume=None, settle=0.0,
+                 predicted=0.0, chamber=None):
+        self.kind = kind
+        self.cmd = cmd
+        self.volume = volume
+        self.settle = settle
+        self.predicted = predicted
+        self.chamber = chamber
+
+    def __str__(self):
+        if self.kind == 'valve':
+            return self.cmd
+        return '%s %s' % (self.kind, self.volume)
+
+
+class DispensePlan(object):
+    """The ordered valve moves and pump strokes of one control period."""
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.predicted = sum(s.predicted for s in steps)
+        self.actual = None
+        self.skipped = []  # chambers (1 indexed) with nothing to dispense
+
+    def __str__(self):
+        return '; '.join(str(s) for s in self.steps)
+
+
+class DispenseScheduler(object):
+    """Plans and runs the dilutions of each control period.
+
+    A plan is built from u (pumps x chambers), skipping chambers that get no
+    media. Valve settling is timed from when the command is sent rather
+    than with a fixed sleep afterwards. The media valve can therefore be
+    selected with begin() before the control loop logs its data, and the
+    settle overlaps that work. A pump stroke only starts once the valves it
+    depends on have settled, and a valve only moves once the pump has
+    stopped, so no fluid path changes while the pump is running.
+
+    Settle times come from the [pump] section, defaulting to the delays the
+    controller has always used:
+        mediasettle: after selecting the media valve (0.5 s).
+        valvesettle: after selecting a chamber valve (1.0 s, servo valves;
+            solenoid pinch valves need ~0.1 s).
+        banksettle: after closing all valves when moving from chambers 1-4
+            to 5-8, so no two valves are ever open at once (2.0 s).
+        overdraw: antibacklash volume drawn and returned each period (100).
+    """
+
+    def __init__(self, serpt, pump, pparams, stdout_lock=None):
+        self.serpt = serpt
+        self.pump = pump
+        self.pparams = pparams
+        self.stdout_lock = stdout_lock or threading.RLock()
+        self.media_settle = float(pparams.get('mediasettle', 0.5))
+        self.valve_settle = float(pparams.get('valvesettle', 1.0))
+        self.bank_settle = float(pparams.get('banksettle', 2.0))
+        self.overdraw_volume = float(pparams.get('overdraw', 100))
+        self.roundingfix = pparams.get('roundingfix', 'false').lower() == 'true'
+        self._ready_at = 0.0
+        self._begun = 0
+        self._start = 0.0
+
+    def _strokeTime(self, volume):
+        """Predicted seconds for one pump stroke of volume."""
+        estimate = getattr(self.pump, 'estimatePumping', None)
+        if estimate is None:
+            return 0.0
+        return estimate(volume)
+
+    def _pumpSteps(self, kind, volume, chamber=None):
+        return Step(kind, volume=volume, predicted=self._strokeTime(volume),
+                    chamber=chamber)
+
+    def plan(self, u):
+        """Build the plan for dispensing u.
+
+        Args:
+            u: array of dilution values, shape (pumps, chambers).
+
+        Returns:
+            a DispensePlan; it has no steps if every chamber's u is 0.
+        """
+        active = [ch for ch in range(u.shape[1]) if u[:, ch].any()]
+        if not active:
+            plan = DispensePlan([])
+            plan.skipped = list(range(1, u.shape[1] + 1))
+            return plan
+
+        overdraw = ones((u.shape[0], 1)) * self.overdraw_volume
+        steps = [Step('valve', 'sel0;', settle=self.media_settle,
+                      predicted=self.media_settle)]
+        if not self.roundingfix:
+            steps.append(self._pumpSteps(
+                'withdraw', u[:, active].sum(axis=1) + self.overdraw_volume))
+        else:
+            # withdraw each volume sepparately so when we dispense sepparetly
+            # the rounding errors cancel out
+            for ch in active:
+                steps.append(self._pumpSteps('withdraw', u[:, ch], ch + 1))
+            # withdraw some extra to take care of backlash
+            steps.append(self._pumpSteps('withdraw', overdraw))
+        steps.append(self._pumpSteps('dispense', overdraw))
+
+        previous = 0
+        for ch in active:
+            chamber_num = ch + 1
+            # If we're moving from PV1 to PV2 then close first
+            # to prevent leaks into tube 5; i.e. so no two are open at once
+            if previous < 5 <= chamber_num:
+                steps.append(Step('valve', 'clo;', settle=self.bank_settle,
+                                  predicted=self.bank_settle))
+            steps.append(Step('valve', 'sel%d;' % chamber_num,
+                              settle=self.valve_settle,
+                              predicted=self.valve_settle,
+                              chamber=chamber_num))
+            steps.append(self._pumpSteps('dispense', u[:, ch], chamber_num))
+            previous = chamber_num
+        # Nothing waits on the final close.
+        steps.append(Step('valve', 'clo;'))
+
+        plan = DispensePlan(steps)
+        plan.skipped = [ch + 1 for ch in range(u.shape[1]) if ch not in active]
+        return plan
+
+    def _send(self, step):
+        with self.serpt.lock:
+            self.serpt.write(step.cmd)
+        with self.stdout_lock:
+            print step.cmd
+        self._ready_at = time() + step.settle
+
+    def _waitReady(self):
+        dt = self._ready_at - time()
+        if dt > 0:
+            sleep(dt)
+
+    def begin(self, plan):
+        """Send the valve move that starts plan without waiting for it to settle.
+
+        The caller can do other work while the valve settles; execute() then
+        runs the rest of the plan.
+        """
+        self._start = time()
+        self._begun = 0
+        if plan.steps and plan.steps[0].kind == 'valve':
+            self._send(plan.steps[0])
+            self._begun = 1
+
+    def execute(self, plan):
+        """Run plan (or what is left of it after begin()).
+
+        Returns:
+            the actual duration in seconds, measured from begin() if it
+            was called.
+        """
+        if not self._begun:
+            self._start = time()
+        for step in plan.steps[self._begun:]:
+            self._waitReady()
+            if step.kind == 'valve':
+                self._send(step)
+                continue
+            if step.chamber is not None and step.kind == 'dispense':
+                with self.stdout_lock:
+                    print 'dispensing', step.volume, 'into chamber', step.chamber
+            getattr(self.pump, step.kind)(step.volume)
+            self.pump.waitForPumping()
+        self._begun = 0
+        plan.actual = time() - self._start
+        return plan.actual
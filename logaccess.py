@@ -0,0 +1,103 @@
+"""Constant time access to the ends of the experiment logs.
+
+The fulllog and odlog only ever grow, one record per line. Scripts run
+from cron only need their first record (the experiment start), their
+last one (the current state) or the records added since their last run,
+so instead of reading the whole log the first line is read once and
+cached, the last line is found by reading backwards from the end of the
+file, and new lines are read from a saved byte offset. A line the
+controller is still writing (no newline yet) is not a complete record
+and is skipped.
+"""
+
+import os
+
+# first lines by file name, with the file's identity and the length read
+_first_lines = {}
+
+
+def first_line(filename):
+    """First non-empty line of a log, without the line ending.
+
+    The line is cached, it is only read again if the log was replaced
+    or truncated since.
+
+    Raises:
+        IOError if the log can not be read, ValueError if it has no
+        complete line yet.
+    """
+    st = os.stat(filename)
+    identity = (st.st_dev, st.st_ino)
+    cached = _first_lines.get(filename)
+    if cached is not None and cached[0] == identity and st.st_size >= cached[2]:
+        return cached[1]
+    length = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            length += len(line)
+            if not line.endswith(b'\n'):
+                break
+            if line.strip():
+                line = line.decode('utf-8').rstrip('\r\n')
+                _first_lines[filename] = (identity, line, length)
+                return line
+    raise ValueError('no complete record in log: %s' % filename)
+
+
+def last_line(filename, chunk_size=4096):
+    """Last complete, non-empty line of a log, without the line ending.
+
+    The log is read backwards from the end chunk_size bytes at a time
+    until a whole line is found, so the cost depends on the length of
+    the last lines and not on the size of the log.
+
+    Raises:
+        IOError if the log can not be read, ValueError if it has no
+        complete line yet.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b''
+        while pos > 0:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+            # everything after the last newline is still being written
+            lines = data[:data.rfind(b'\n') + 1].split(b'\n')
+            # the first line read may start before this chunk
+            if pos > 0:
+                lines = lines[1:]
+            for line in reversed(lines):
+                if line.strip():
+                    return line.decode('utf-8').rstrip('\r')
+    raise ValueError('no complete record in log: %s' % filename)
+
+
+def lines_from(filename, offset):
+    """Complete lines added to a log since offset.
+
+    Args:
+        filename: path of the log.
+        offset: byte offset returned by the previous call, 0 to read the
+            whole log.
+
+    Returns:
+        tuple (lines, offset): list of the complete lines (decoded, with
+        their line endings) and the offset to pass to the next call. A
+        line still being written is left for the next call.
+
+    Raises:
+        IOError if the log can not be read, ValueError if it is shorter
+        than offset (it was replaced or truncated).
+    """
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < offset:
+            raise ValueError('log is shorter than offset %d: %s'
+                             % (offset, filename))
+        f.seek(offset)
+        data = f.read()
+    data = data[:data.rfind(b'\n') + 1]
+    return data.decode('utf-8').splitlines(True), offset + len(data)
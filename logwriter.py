@@ -0,0 +1,167 @@
+from time import time
+
+import os
+import sys
+import threading
+import traceback
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+
+class LogWriter(threading.Thread):
+    """Background writer for the experiment log files.
+
+    Keeps one long lived append handle per log file and drains a bounded
+    queue of lines from a single thread, so callers (the serial reader and
+    the control loop) never block on the SD card. Lines are written in
+    batches and flushed every flush_interval seconds, optionally followed
+    by an fsync.
+
+    Usage:
+        lw = LogWriter(logfiles)
+        lw.start()
+        lw.write('odlog', '1508520000 512 600 ...')
+        lw.close()  # flushes and closes every handle
+    """
+
+    def __init__(self, logfiles, flush_interval=1.0, fsync=False,
+                 maxqueue=10000):
+        """Initialize the writer.
+
+        Args:
+            logfiles: dictionary of log names to file paths (the [log]
+                section of config.ini).
+            flush_interval: seconds between flushes of the open handles.
+            fsync: if True, fsync every handle after it is flushed.
+            maxqueue: maximum number of lines waiting to be written.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.logfiles = logfiles
+        self.flush_interval = float(flush_interval)
+        self.fsync = fsync
+        self.dropped = 0
+        self._q = Queue(maxqueue)
+        self._handles = {}
+        self._dirty = set()
+        self._stop_marker = object()
+
+    @classmethod
+    def fromConfig(cls, logfiles):
+        """Make a writer using the optional settings in the [log] section.
+
+        Recognized keys are flushinterval (seconds, default 1.0),
+        fsync (true/false, default false) and logqueue (lines, default 10000).
+        """
+        return cls(logfiles,
+                   flush_interval=float(logfiles.get('flushinterval', 1.0)),
+                   fsync=logfiles.get('fsync', 'false').lower() == 'true',
+                   maxqueue=int(logfiles.get('logqueue', 10000)))
+
+    def write(self, name, line):
+        """Queue a line for the log called name. Never blocks.
+
+        Args:
+            name: key of the log in logfiles (e.g. 'odlog', 'fulllog').
+            line: the text to write, without a trailing newline.
+        """
+        try:
+            self._q.put_nowait((name, line))
+        except Full:
+            # Losing a line is better than stalling the serial port.
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """Write everything still queued, flush, fsync and close all files.
+
+        Waits at most timeout seconds for the writer thread. If it is stuck
+        (e.g. on a hung SD card) the files are left open to it.
+
+        Returns:
+            True if the files were closed, False if the writer thread did
+            not stop in time.
+        """
+        deadline = time() + timeout
+        try:
+            self._q.put(self._stop_marker, timeout=timeout)
+        except Full:
+            # The writer thread died or stalled with a full queue.
+            pass
+        if self.is_alive():
+            self.join(max(deadline - time(), 0))
+            if self.is_alive():
+                return False
+        self._drain()
+        self._flush(True)
+        for f in self._handles.values():
+            f.close()
+        self._handles = {}
+        return True
+
+    def _handle(self, name):
+        f = self._handles.get(name)
+        if f is None:
+            f = open(self.logfiles[name], 'a')
+            self._handles[name] = f
+        return f
+
+    def _drain(self):
+        """Write every queued line. Returns False once the stop marker is seen."""
+        while True:
+            try:
+                item = self._q.get_nowait()
+            except Empty:
+                return True
+            if item is self._stop_marker:
+                return False
+            self._write(item)
+
+    def _write(self, item):
+        name, line = item
+        try:
+            self._handle(name).write(line + '\n')
+            self._dirty.add(name)
+        except Exception:
+            # One bad line must not stop the thread, and with it the logs.
+            self._logError()
+
+    def _logError(self):
+        traceback.print_exc(file=sys.stdout)
+        try:
+            f = open('errors.log', 'a')
+            f.write('===== time:' + str(time()) + '\n')
+            traceback.print_exc(file=f)
+            f.close()
+        except (IOError, OSError):
+            pass
+
+    def _flush(self, force_sync=False):
+        for name in self._dirty:
+            f = self._handles[name]
+            try:
+                f.flush()
+                if self.fsync or force_sync:
+                    os.fsync(f.fileno())
+            except (IOError, OSError):
+                self._logError()
+        self._dirty = set()
+
+    def run(self):
+        next_flush = time() + self.flush_interval
+        while True:
+            try:
+                item = self._q.get(timeout=max(next_flush - time(), 0.01))
+            except Empty:
+                item = None
+            if item is self._stop_marker:
+                return
+            if item is not None:
+                self._write(item)
+                if not self._drain():
+                    return
+            if time() >= next_flush:
+                self._flush()
+                next_flush = time() + self.flush_interval
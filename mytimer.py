@@ -1,83 +1,220 @@
 from time import time, sleep
 
+import heapq
 import sys
 import traceback
 import threading
 
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2: use the monotonic package if it is installed.
+    try:
+        from monotonic import monotonic
+    except ImportError:
+        # Wall clock time jumps with NTP and manual clock changes, which
+        # shifts or bunches up every deadline of the scheduler.
+        sys.stderr.write(
+            '\n*** WARNING: no monotonic clock, the scheduler falls back to '
+            'time.time() and is thrown off by system clock changes.\n'
+            '*** Install it with: sudo pip install monotonic\n\n')
+        monotonic = time
 
-class mytimer(threading.Thread):
+
+# What to do when a callback runs past one or more of its deadlines.
+SKIP = 'skip'          # drop the missed runs, wait for the next deadline
+CATCHUP = 'catchup'    # run every missed deadline back to back
+COALESCE = 'coalesce'  # run once right away for all missed deadlines
+POLICIES = (SKIP, CATCHUP, COALESCE)
+
+
+class Job(object):
+    """A periodic callback and its timing statistics (seconds)."""
+
+    def __init__(self, period, callback, policy=SKIP, name=None):
+        if policy not in POLICIES:
+            raise ValueError('unknown overrun policy: %s' % policy)
+        self.period = float(period)
+        self.cb = callback
+        self.policy = policy
+        self.name = name or getattr(callback, '__name__', 'job')
+        self.deadline = 0.0
+        self.cancelled = False
+
+        self.runs = 0
+        self.overruns = 0     # runs that ended after the next deadline
+        self.missed = 0       # deadlines skipped or coalesced
+        self.jitter_last = 0.0
+        self.jitter_max = 0.0
+        self._jitter_sum = 0.0
+
+    def jitter_mean(self):
+        if self.runs == 0:
+            return 0.0
+        return self._jitter_sum / self.runs
+
+    def stats(self):
+        return {'name': self.name, 'runs': self.runs,
+                'overruns': self.overruns, 'missed': self.missed,
+                'jitter_last': self.jitter_last,
+                'jitter_mean': self.jitter_mean(),
+                'jitter_max': self.jitter_max}
+
+
+class Scheduler(threading.Thread):
+    """Runs periodic jobs from a single thread on the monotonic clock.
+
+    Deadlines are kept on each job's grid (start + n * period), so clock
+    jitter does NOT accumulate, and wall clock steps (e.g. NTP on the Pi)
+    do not affect the schedule. Jobs are kept in a heap ordered by deadline
+    and the thread waits on a condition, so stop() and add() take effect
+    immediately.
+
+    When a callback overruns one or more of its deadlines the job's policy
+    decides what happens; see SKIP, CATCHUP and COALESCE.
+    Exceptions from callbacks are printed and appended to errors.log.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._heap = []
+        self._seq = 0
+        self._cv = threading.Condition()
+        self.go = True
+
+    def add(self, period, callback, policy=SKIP, name=None, delay=0.0):
+        """Schedule callback every period seconds, first after delay.
+
+        Returns:
+            the Job, which holds the timing statistics.
+        """
+        job = Job(period, callback, policy, name)
+        with self._cv:
+            job.deadline = monotonic() + delay
+            self._push(job)
+            self._cv.notify()
+        return job
+
+    def cancel(self, job):
+        with self._cv:
+            job.cancelled = True
+            self._cv.notify()
+
+    def stop(self):
+        with self._cv:
+            self.go = False
+            self._cv.notify()
+
+    def _push(self, job):
+        self._seq += 1
+        heapq.heappush(self._heap, (job.deadline, self._seq, job))
+
+    def _reschedule(self, job, now):
+        """Set the next deadline of job after it finished at now."""
+        next_deadline = job.deadline + job.period
+        if next_deadline > now:
+            job.deadline = next_deadline
+            return
+        job.overruns += 1
+        missed = int((now - next_deadline) // job.period) + 1
+        if job.policy == CATCHUP:
+            job.deadline = next_deadline
+        elif job.policy == COALESCE:
+            # One run now stands in for all the missed deadlines.
+            job.missed += missed - 1
+            job.deadline = next_deadline + (missed - 1) * job.period
+        else:
+            job.missed += missed
+            job.deadline = next_deadline + missed * job.period
+
+    def _run_job(self, job):
+        start = monotonic()
+        jitter = start - job.deadline
+        job.runs += 1
+        job.jitter_last = jitter
+        job._jitter_sum += jitter
+        if jitter > job.jitter_max:
+            job.jitter_max = jitter
+        try:
+            job.cb()
+        except:
+            traceback.print_exc(file=sys.stdout)
+            f = open('errors.log', 'a')
+            t = time()
+            f.write('===== time:' + str(t)+  '\n' )
+            traceback.print_exc(file=f)
+            f.close()
+
+    def run(self):
+        while True:
+            with self._cv:
+                while self.go:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if self._heap:
+                        dt = self._heap[0][0] - monotonic()
+                        if dt <= 0:
+                            break
+                        self._cv.wait(dt)
+                    else:
+                        self._cv.wait()
+                if not self.go:
+                    return
+                job = heapq.heappop(self._heap)[2]
+            self._run_job(job)
+            with self._cv:
+                if not job.cancelled:
+                    self._reschedule(job, monotonic())
+                    self._push(job)
+
+
+class mytimer(object):
     """Custom timer thread.
-    
+
     Calls a callback once every period (in seconds).
-    Callback takes no arguements.  
-    
-    Also, note that callbacks are /periodic/ with the EXACT 
-    average period of period. Unlike the threading.Timer class, clock jitter
-    does NOT accumulate! 
-    
-    Not sure what the smallest period possible is. 3 seconds is definitely good.
+    Callback takes no arguements.
+
+    Kept for code that wants a single periodic callback; it runs one job on
+    its own Scheduler. Callbacks are /periodic/ with the EXACT average
+    period of period, and overruns follow policy (default SKIP).
     """
-    
-    def __init__(self, period, callback):
+
+    def __init__(self, period, callback, policy=SKIP):
         """Initialize the timer.
-        
+
         Args:
             period: how frequently to call the callback (seconds).
             callback: zero-argument function to call.
+            policy: overrun policy, one of POLICIES.
         """
-        threading.Thread.__init__(self)
-        self.starttime = 0
         self.p = period
         self.cb = callback
-        self.go = True
-        
+        self.policy = policy
+        self.job = None
+        self._sched = Scheduler()
+
     def start(self):
-        self.starttime = time()
-        threading.Thread.start(self)
-    
+        self.job = self._sched.add(self.p, self.cb, self.policy)
+        self._sched.start()
+
     def stop(self):
-        self.go = False
+        self._sched.stop()
 
-    def _myround(self, x, base):
-        """Custom rounding method.
-        
-        Rounds "x" to a number that is divisible by "base".
-        
-        Args:
-            x: value to round.
-            base: return value should be divisble by base.
-        """
-        return int(base * round(float(x)/base))
+    def join(self, timeout=None):
+        self._sched.join(timeout)
 
-    def _mytime(self):
-        return time() - self.starttime
-        
-    def run(self):
-        while self.go:
-            next_time = self._myround(self._mytime()+self.p,self.p)
-            try:
-                self.cb()
-            except:
-                traceback.print_exc(file=sys.stdout)
-                f = open('errors.log', 'a')
-                t = time()
-                f.write('===== time:' + str(t)+  '\n' )
-                traceback.print_exc(file=f)
-                f.close()
-                
-            # Sleep until next_time
-            while self._mytime() < (next_time - 0.01) and self.go:
-                dt = next_time - self._mytime()
-                if dt > 1:
-                    dt = 1
-                sleep(dt)
-    
 
 def _callme():
     """Test callback."""
-    print "tick: ", str(time())
-    
-    
+    print("tick: " + str(time()))
+
+
 if __name__ == '__main__':
     mt = mytimer(3, _callme)
     mt.start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        mt.stop()
@@ -1,62 +1,245 @@
+import os
 import socket
-import pickle
 import threading
 from time import sleep
 
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+
+class _Client(threading.Thread):
+    """Serves one connection of a CTBasicServer, one line at a time.
+
+    Streamed lines go through a bounded queue drained by a sender thread
+    of their own, so publish() never waits on the network. A client that
+    does not read fast enough to keep its queue from filling up is
+    disconnected.
+    """
+
+    def __init__(self, server, conn, addr):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.server = server
+        self.conn = conn
+        self.addr = addr
+        self.send_lock = threading.Lock()
+        self.closed = False
+        self.stream_queue = Queue(server.stream_queue_size)
+        self.sender = threading.Thread(target=self._sendStream)
+        self.sender.daemon = True
+
+    def send(self, msg):
+        """Send msg as one line. Returns False if the connection is gone."""
+        if not msg.endswith(self.server.delim):
+            msg += self.server.delim
+        if not isinstance(msg, bytes):
+            msg = msg.encode('utf-8')
+        try:
+            with self.send_lock:
+                self.conn.sendall(msg)
+            return True
+        except socket.error:
+            return False
+
+    def stream(self, line):
+        """Queue line for the sender thread. Never blocks.
+
+        Returns False if the client is gone or its queue is full.
+        """
+        if self.closed:
+            return False
+        try:
+            self.stream_queue.put_nowait(line)
+            return True
+        except Full:
+            return False
+
+    def close(self):
+        """Disconnect, waking up both threads of this client."""
+        self.closed = True
+        try:
+            # wakes the sender thread if it is waiting for a line
+            self.stream_queue.put_nowait(None)
+        except Full:
+            pass
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _sendStream(self):
+        while not self.closed:
+            try:
+                line = self.stream_queue.get(timeout=1.0)
+            except Empty:
+                continue
+            if line is None or not self.send(line):
+                break
+        self.close()
+
+    def run(self):
+        self.sender.start()
+        f = self.conn.makefile('rb')
+        try:
+            while not self.server.quitting:
+                line = f.readline()
+                # connection has been closed
+                if not line:
+                    break
+                if not isinstance(line, str):
+                    line = line.decode('utf-8', 'replace')
+                line = line.strip()
+                if not line:
+                    continue
+                response = self.server.handle(self, line)
+                if response and not self.send(response):
+                    break
+        except socket.error:
+            pass
+        finally:
+            self.server.forget(self)
+            self.close()
+            self.sender.join()
+            f.close()
+            self.conn.close()
+
 
 class CTBasicServer(threading.Thread):
+    """Line framed TCP (or Unix socket) server that serves many clients at once.
+
+    Every client gets its own thread. Each line a client sends is a
+    command; it is passed to message_cb and the returned string is sent
+    back as one line. Two commands are handled by the server itself:
+
+        stream      send every line given to publish() to this client
+        unstream    stop streaming
+
+    so monitoring tools can follow the running controller live. Up to
+    stream_queue_size lines wait for each streaming client; a client
+    falling further behind is dropped.
+    """
 
-    def __init__(self,hp,message_cb, delim = '\n'):
+    def __init__(self, hp, message_cb, delim='\n', stream_queue_size=1000):
         """ hp <= a tuple of (host,port)
             a host '' means interfaces
-            
+            or a path (string) to listen on a local Unix socket instead
+
             message_cb <= a callback function for when data is ready
             (data is ready when delim is encountered)
             should return a string meant to be a response.
+
+            stream_queue_size <= lines held for each streaming client
         """
         threading.Thread.__init__(self)
         self.delim = delim
         self.host_port = hp
-        soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if isinstance(hp, str):
+            soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.s = soc
         self.quitting = False
         self.daemon = True
         self.mcb = message_cb
+        self.stream_queue_size = stream_queue_size
+        self._subscribers = set()
+        # every connected client, closed by quit()
+        self._clients = set()
+        self._sub_lock = threading.Lock()
+
+    def handle(self, client, cmd):
+        """Answer one command line from client."""
+        words = cmd.split()
+        if not words:
+            return None
+        word = words[0].lower()
+        if word == 'stream':
+            with self._sub_lock:
+                self._subscribers.add(client)
+            return 'streaming'
+        if word == 'unstream':
+            self.unsubscribe(client)
+            return 'not streaming'
+        try:
+            return self.mcb(cmd)
+        except Exception as e:
+            return 'error: %s' % e
+
+    def unsubscribe(self, client):
+        with self._sub_lock:
+            self._subscribers.discard(client)
+
+    def forget(self, client):
+        """Drop a client whose connection has ended."""
+        with self._sub_lock:
+            self._subscribers.discard(client)
+            self._clients.discard(client)
+
+    def publish(self, line):
+        """Queue line for every streaming client. Never blocks.
+
+        Clients that are gone or too far behind are dropped.
+        """
+        with self._sub_lock:
+            clients = list(self._subscribers)
+        for client in clients:
+            if not client.stream(line):
+                self.unsubscribe(client)
+                client.close()
 
     def run(self):
+        if isinstance(self.host_port, str) and os.path.exists(self.host_port):
+            # left over from a previous run
+            os.remove(self.host_port)
         self.s.bind(self.host_port)
         self.s.listen(5)
         while not self.quitting:
             conn,addr = self.s.accept()
             #check if we unblocked because we need to quit
             if self.quitting:
+                conn.close()
                 return
-            
-            data = ''
-            while True:
-                d = conn.recv(2048)
-                data += d
-                delind = data.find(self.delim)
-                #found a delimiter
-                if (delind>=0):
-                    #send data to callback 
-                    send_str = self.mcb(data[0:delind])
-                    if send_str:
-                        conn.sendall(send_str)
-                    data = data[delind+1:]
-                #connection has been closed
-                if not d:
-                    break
-            
+            client = _Client(self, conn, addr)
+            with self._sub_lock:
+                self._clients.add(client)
+            client.start()
+
+    def quit(self, timeout=2.0):
+        """Stop accepting, disconnect every client and close the socket.
 
-    def quit(self):
+        Waits up to timeout seconds for each thread to end, so none is
+        left running into interpreter shutdown.
+        """
         self.quitting = True
         #connect to self to unblock accept()
-        s2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s2.connect(('localhost',port))
+        if isinstance(self.host_port, str):
+            s2 = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.host_port
+        else:
+            s2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = ('localhost', self.host_port[1])
+        try:
+            s2.connect(address)
+        except socket.error:
+            pass
+        s2.close()
+        if self.is_alive():
+            self.join(timeout)
+        with self._sub_lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        for client in clients:
+            client.join(timeout)
+        self.s.close()
+        if isinstance(self.host_port, str) and os.path.exists(self.host_port):
+            os.remove(self.host_port)
 
 def __test_cb(data):
-    print data
+    print(data)
     return 'your data: ' +data
 
 if __name__ == '__main__':
@@ -67,9 +250,9 @@ if __name__ == '__main__':
     try:
         while True:
             sleep(0.25)
+            t.publish('tick')
     except KeyboardInterrupt:
         pass #absorb keyboard interrup and quit
     finally:
         t.quit()
         t.join()
-
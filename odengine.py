@@ -0,0 +1,111 @@
+"""Optical density computation shared by the controller and the analysis scripts.
+
+OD is computed from the blank and the measured transmitted (tx) and
+reflected (rx) light as
+
+    od = log10((brx / btx) / (rx / tx))
+
+for every chamber at once. A zero in any of the four readings means the
+chamber could not be read, and its OD is reported as 0, matching what
+the controller has always logged.
+"""
+
+import numpy
+
+
+def compute_ods(btx, brx, tx, rx):
+    """Vectorized OD for all chambers (and optionally many samples).
+
+    Args:
+        btx: blank transmitted light values, one per chamber.
+        brx: blank reflected light values, one per chamber.
+        tx: transmitted light values, shape (chambers,) or (samples, chambers).
+        rx: reflected light values, same shape as tx.
+
+    Returns:
+        float array broadcast to the shape of tx, 0 wherever a reading is 0.
+    """
+    btx = numpy.asarray(btx, dtype=float)
+    brx = numpy.asarray(brx, dtype=float)
+    tx = numpy.asarray(tx, dtype=float)
+    rx = numpy.asarray(rx, dtype=float)
+    valid = (tx != 0) & (rx != 0) & (btx != 0) & (brx != 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        blank = brx / btx
+        measurement = rx / tx
+        ods = numpy.log10(blank / measurement)
+    return numpy.where(valid, ods, 0.0)
+
+
+def split_readings(values):
+    """Split interleaved 'tx1 rx1 tx2 rx2 ...' values into (tx, rx) arrays.
+
+    Works on the last axis, so a 2-D block of odlog rows can be split too.
+    """
+    values = numpy.asarray(values)
+    return values[..., 0::2], values[..., 1::2]
+
+
+def read_blank(filename):
+    """Read a blank.dat file.
+
+    Returns:
+        tuple of int arrays (btx, brx).
+
+    Raises:
+        IOError if the file can not be read, ValueError if it is malformed.
+    """
+    with open(filename, 'r') as bf:
+        blank_values = [int(v) for v in bf.readline().split()]
+    if len(blank_values) == 0 or len(blank_values) % 2:
+        raise ValueError('malformed blank file: %s' % filename)
+    return split_readings(blank_values)
+
+
+def write_blank(filename, btx, brx):
+    """Write tx/rx blank values to filename, interleaved on one line."""
+    flat_blank = [str(int(j)) for i in zip(btx, brx) for j in i]
+    with open(filename, 'w') as bf:
+        bf.write('%s\n' % ' '.join(flat_blank))
+
+
+def read_odlog(filename):
+    """Load a whole odlog file.
+
+    Each line is 'timestamp tx1 rx1 tx2 rx2 ...'.
+
+    Returns:
+        tuple (timestamps, tx, rx) where tx and rx have shape
+        (lines, chambers).
+    """
+    data = numpy.loadtxt(filename, dtype=numpy.int64, ndmin=2)
+    tx, rx = split_readings(data[:, 1:])
+    return data[:, 0], tx, rx
+
+
+class ODEngine(object):
+    """Keeps the blank as persistent arrays and computes ODs against it."""
+
+    def __init__(self, btx=None, brx=None):
+        self.btx = None
+        self.brx = None
+        if btx is not None and brx is not None:
+            self.setBlank(btx, brx)
+
+    def hasBlank(self):
+        return self.btx is not None and len(self.btx) > 0
+
+    def setBlank(self, btx, brx):
+        self.btx = numpy.array(btx, dtype=numpy.int64)
+        self.brx = numpy.array(brx, dtype=numpy.int64)
+
+    def loadBlank(self, filename):
+        """Load the blank from filename. Raises IOError/ValueError on failure."""
+        self.setBlank(*read_blank(filename))
+
+    def saveBlank(self, filename):
+        write_blank(filename, self.btx, self.brx)
+
+    def compute(self, tx, rx):
+        """ODs of tx/rx against the stored blank (see compute_ods)."""
+        return compute_ods(self.btx, self.brx, tx, rx)
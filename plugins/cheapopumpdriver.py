@@ -83,6 +83,14 @@ class Pump:
         """
         self.withdraw(-volume)
         
+    def estimatePumping(self, volume):
+        """  Predicted seconds for withdraw(volume) or dispense(volume)
+        
+        """
+        if volume.size > 2:
+            return 0.0
+        return max([max(4*abs(v)/1600., 1) for v in volume.flat])
+        
     def waitForPumping(self):
         """ Block until pumping is done
         
@@ -88,6 +88,14 @@ class Pump(object):
             self._pumpGetResponse()
             print "INF %s" % u
             
+    def estimatePumping(self, volume):
+        """Predicted seconds for withdraw(volume) or dispense(volume)."""
+        # syringerate is in volume units per minute (UM) or per hour (UH)
+        rate = float(self.pparams['syringerate'])
+        if self.pparams.get('syringrateunit', 'UM').upper().endswith('H'):
+            rate = rate / 60.0
+        return abs(float(volume.sum())) / rate * 60.0
+            
     def waitForPumping(self):
         pump = self.pport
         while True:
@@ -1,4 +1,4 @@
-from numpy import array
+from numpy import array, clip
 
 class State(object):
     """The state variable for the control funcion
@@ -29,22 +29,48 @@ def computeControl(self,od,z,chamber=0,time=0.0):
     if z == None:
         z = State()
     #calculate control
-    setpoints = map(float,self.cparams['setpoint'].split())
+    p = self.params
+    setpoints = p.setpoint
     #for debug
 #    print "setpoints: "+ str(setpoints)+ "this: " + str(setpoints[chamber])
     
     err_sig = 1000*(od-setpoints[chamber])
-    z.z = z.z+err_sig*float(self.cparams['ki'])
+    z.z = z.z+err_sig*p.ki
     if z.z<0:
         z.z = 0
-    if z.z>float(self.cparams['maxdilution']):
-        z.z = float(self.cparams['maxdilution'])
-    
-    u = z.z+err_sig*float(self.cparams['kp'])
-    if u < float(self.cparams['mindilution']):
-        u = float(self.cparams['mindilution'])
-    if u > float(self.cparams['maxdilution']):
-        u = float(self.cparams['maxdilution'])
+    if z.z>p.maxdilution:
+        z.z = p.maxdilution
+    
+    u = z.z+err_sig*p.kp
+    if u < p.mindilution:
+        u = p.mindilution
+    if u > p.maxdilution:
+        u = p.maxdilution
     u = int(u) # make sure u is an int
     
     return (array([u]),z)
+
+
+def computeControlBatch(self,ods,states,time=0.0):
+    """  Controller function for all chambers at once
+    
+    Same control law as computeControl, vectorized over chambers.
+    
+    self: the main controller object, as for computeControl
+    ods: array of current ods, one per chamber
+    states: list of state objects (or None), one per chamber
+    time: the current time since start up.
+    
+    Returns: a tuple (array of dilution values, shape (1, chambers),
+        list of state objects)
+    
+    """
+    p = self.params
+    states = [State() if z is None else z for z in states]
+    z = array([s.z for s in states], dtype=float)
+    err_sig = 1000*(array(ods)-p.setpoint)
+    z = clip(z+err_sig*p.ki, 0, p.maxdilution)
+    u = clip(z+err_sig*p.kp, p.mindilution, p.maxdilution)
+    for state, zval in zip(states, z):
+        state.z = float(zval)
+    return (u.astype(int).reshape(1, -1), states)
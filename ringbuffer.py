@@ -0,0 +1,111 @@
+import threading
+
+import numpy
+
+
+def trimmed_mean(samples, proportion=0.1):
+    """Mean of each column after dropping the lowest and highest proportion."""
+    n = samples.shape[0]
+    cut = int(n * proportion)
+    if n - 2 * cut <= 0:
+        return numpy.median(samples, axis=0)
+    ordered = numpy.sort(samples, axis=0)
+    return ordered[cut:n - cut].mean(axis=0)
+
+
+REDUCERS = {
+    'mean': lambda samples: samples.mean(axis=0),
+    'median': lambda samples: numpy.median(samples, axis=0),
+    'trimmed': trimmed_mean,
+}
+
+
+class SampleRing(object):
+    """Fixed capacity buffer of raw samples, one row per sample.
+
+    Rows are written into a preallocated (capacity, chambers) array, so an
+    append is O(1) and memory use does not grow with the length of the run.
+    If more than capacity samples arrive between two calls to take(), the
+    oldest ones are overwritten.
+
+    Two buffers are kept. take() only swaps them under the lock; the caller
+    then reduces the returned samples without holding it, while appends go
+    to the other buffer. Only one thread should call take().
+    """
+
+    def __init__(self, capacity=256, dtype=numpy.int64):
+        """Initialize the buffer.
+
+        Args:
+            capacity: maximum number of samples kept between take() calls.
+            dtype: element type of the stored samples.
+        """
+        self.capacity = int(capacity)
+        self.dtype = dtype
+        self.lock = threading.RLock()
+        self.chambers = None
+        self._bufs = None
+        self._active = 0
+        self._count = 0  # samples in the active buffer, capped at capacity
+        self._next = 0   # next row to write in the active buffer
+        self.overwritten = 0
+
+    def _allocate(self, chambers):
+        self.chambers = chambers
+        self._bufs = [numpy.zeros((self.capacity, chambers), dtype=self.dtype),
+                      numpy.zeros((self.capacity, chambers), dtype=self.dtype)]
+
+    def append(self, sample):
+        """Add one sample (a sequence with one value per chamber).
+
+        Raises:
+            ValueError if the sample does not have one value per chamber.
+        """
+        with self.lock:
+            if self._bufs is None:
+                self._allocate(len(sample))
+            elif len(sample) != self.chambers:
+                raise ValueError('expected %d values, got %d'
+                                 % (self.chambers, len(sample)))
+            self._bufs[self._active][self._next] = sample
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+            else:
+                self.overwritten += 1
+
+    def __len__(self):
+        return self._count
+
+    def take(self):
+        """Return the samples since the last take() and start a new period.
+
+        Returns:
+            array of shape (samples, chambers). It is a view into the
+            inactive buffer and stays valid until the next take().
+        """
+        with self.lock:
+            if self._bufs is None or self._count == 0:
+                return numpy.zeros((0, self.chambers or 0), dtype=self.dtype)
+            buf, count = self._bufs[self._active], self._count
+            self._active = 1 - self._active
+            self._count = 0
+            self._next = 0
+        # Row order does not matter to any of the reducers.
+        return buf[:count]
+
+    def reduce(self, reducer='mean'):
+        """take() and reduce down the columns.
+
+        Args:
+            reducer: a key of REDUCERS or a function of a 2D array.
+
+        Returns:
+            array with one value per chamber, empty if there were no samples.
+        """
+        samples = self.take()
+        if samples.shape[0] == 0:
+            return numpy.zeros(0)
+        if not callable(reducer):
+            reducer = REDUCERS[reducer]
+        return reducer(samples)
@@ -0,0 +1,117 @@
+from time import time
+
+import sys
+import threading
+import traceback
+
+
+class SerialReader(threading.Thread):
+    """Reader thread for the controller board serial port.
+
+    Blocks on the port instead of polling it, so each line is handed to the
+    callback as soon as its newline arrives. Bytes are buffered until a
+    line is complete, so a read that stops mid-line is simply continued by
+    the next one.
+
+    The port should be opened with a read timeout (servostat uses 4 s);
+    that timeout bounds how long stop() takes to be noticed.
+
+    Receive latency is the time from the first byte of a line arriving to
+    the callback for that line returning.
+
+    If reading fails (e.g. the port was unplugged) the error is printed and
+    appended to errors.log, and the read is retried after retry_delay
+    seconds, doubling after each failure up to max_retry_delay.
+    """
+
+    def __init__(self, port, line_cb, delim='\n', retry_delay=2.0,
+                 max_retry_delay=60.0):
+        """Initialize the reader.
+
+        Args:
+            port: an open serial port (anything with read() and inWaiting()).
+            line_cb: function called with each stripped, non-empty line.
+            delim: line terminator.
+            retry_delay: seconds before retrying the first failed read.
+            max_retry_delay: longest wait between retries, in seconds.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.cb = line_cb
+        self.delim = delim
+        self.go = True
+        self.retry_delay = float(retry_delay)
+        self.max_retry_delay = float(max_retry_delay)
+        self._stopped = threading.Event()
+
+        # Latency statistics, in seconds.
+        self.lines = 0
+        self.latency_last = 0.0
+        self.latency_max = 0.0
+        self._latency_sum = 0.0
+
+    def stop(self):
+        self.go = False
+        self._stopped.set()
+
+    def latency_mean(self):
+        """Mean receive latency over all lines so far (seconds)."""
+        if self.lines == 0:
+            return 0.0
+        return self._latency_sum / self.lines
+
+    def _record(self, first_byte_time):
+        dt = time() - first_byte_time
+        self.lines += 1
+        self.latency_last = dt
+        self._latency_sum += dt
+        if dt > self.latency_max:
+            self.latency_max = dt
+
+    def _logError(self):
+        traceback.print_exc(file=sys.stdout)
+        f = open('errors.log', 'a')
+        f.write('===== time:' + str(time()) + '\n')
+        traceback.print_exc(file=f)
+        f.close()
+
+    def run(self):
+        buf = ''
+        first_byte_time = None
+        delay = self.retry_delay
+        while self.go:
+            try:
+                # Blocks until at least one byte arrives or the port
+                # times out; then takes whatever else is already waiting.
+                data = self.port.read(1)
+                if data:
+                    waiting = self.port.inWaiting()
+                    if waiting:
+                        data += self.port.read(waiting)
+            except Exception:
+                self._logError()
+                # A port that is gone fails every read, wait before retrying.
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            if not data:
+                continue
+            if not isinstance(data, str):
+                data = data.decode('ascii', 'replace')
+            if first_byte_time is None:
+                first_byte_time = time()
+            buf += data
+
+            while self.delim in buf:
+                line, buf = buf.split(self.delim, 1)
+                line = line.strip()
+                if line:
+                    try:
+                        self.cb(line)
+                    except Exception:
+                        traceback.print_exc(file=sys.stdout)
+                    self._record(first_byte_time)
+                # Whatever is left over started arriving with this read.
+                first_byte_time = time() if buf else None
@@ -2,6 +2,7 @@ from controller import Controller # Import the Controller object from the contro
 from ConfigParser import SafeConfigParser #Configuration file parser (https://docs.python.org/2/library/configparser.html)
 from network import CTBasicServer #Import object defined in network.py
 
+import json #Javascript object notation (https://docs.python.org/2/library/json.html)
 import argparse # Parser for command line options (https://docs.python.org/3/library/argparse.html)
 import serial   # #Can't find info online but defintely a thing. Seems to involve handleing the serial input ports.
 import stacktracer # imports all fucntions from stacktracer.py (
@@ -11,6 +12,47 @@ import time #Time access and conversions (https://docs.python.org/2/library/time
 import traceback # Print or recieve stack traceback (https://docs.python.org/2/library/traceback.html)
 
 
+NETWORK_HELP = ('commands: list, latest, history [n], setpoint v1 v2 ..., '
+                'exclude [n ...], include n ..., stream, unstream')
+
+
+def network_command(cont, cmd):
+    """Answer one command line from the network port.
+
+    Commands:
+        list                  controller parameters
+        latest                snapshot of the last cycle: ods, u, z,
+                              setpoints, blank... (json)
+        history [n]           snapshots of the last n cycles (json list)
+        setpoint v1 v2 ...    change the setpoints (saved to config.ini)
+        exclude [n ...]       exclude chambers until restart (no args:
+                              list excluded), exclude.txt is not changed
+        include n ...         stop excluding chambers
+        stream / unstream     start/stop receiving every new log line
+                              (handled by CTBasicServer)
+    """
+    words = cmd.split()
+    name, args = words[0].lower(), words[1:]
+    if name == 'list':
+        return str(dict(cont.cparams))
+    if name in ('latest', 'snapshot'):
+        latest = cont.snapshots.latest
+        return latest.toJson() if latest is not None else 'null'
+    if name == 'history':
+        recent = cont.snapshots.recent(args[0] if args else None)
+        return json.dumps([s.asDict() for s in recent])
+    if name == 'setpoint':
+        cont.setSetpoints(args)
+        return 'ok'
+    if name == 'exclude':
+        cont.exclude(args)
+        return ' '.join(str(c) for c in sorted(cont.excluded))
+    if name == 'include':
+        cont.include(args)
+        return ' '.join(str(c) for c in sorted(cont.excluded))
+    return NETWORK_HELP
+
+
 def Main():
     parser = argparse.ArgumentParser(description='Turbidostat controller.') # This section defines the command line inputs
     parser.add_argument("-c", "--config_filename", default="config.ini", # This creates a command line argument c
@@ -49,11 +91,18 @@ def Main():
     cont.start()
     
     # Setup network configue port
-    def cb(cmd):
-        if 'list' in cmd:
-            return str(controller_params)
-    netserv = CTBasicServer(('', int(port_names['network'])), cb)
+    netserv = CTBasicServer(('', int(port_names['network'])),
+                            lambda cmd: network_command(cont, cmd))
+    cont.listeners.append(netserv.publish)
     netserv.start()
+    servers = [netserv]
+    # Optionally serve the same commands on a local Unix socket
+    if port_names.get('unixsocket', 'NONE').upper() != 'NONE':
+        unixserv = CTBasicServer(port_names['unixsocket'],
+                                 lambda cmd: network_command(cont, cmd))
+        cont.listeners.append(unixserv.publish)
+        unixserv.start()
+        servers.append(unixserv)
     
     print 'num threads: ' + str(len(sys._current_frames().keys()))
     # Run until a keyboard interrupt.
@@ -62,6 +111,8 @@ def Main():
             time.sleep(1)
     except KeyboardInterrupt:
         print 'shutting down'
+        for server in servers:
+            server.quit()
         cont.quit()
         time.sleep(1.1)
 
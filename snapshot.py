@@ -0,0 +1,72 @@
+import json
+
+
+class ControllerSnapshot(object):
+    """Read only record of one control cycle.
+
+    Attributes:
+        cycle: number of the cycle since the controller started (from 1).
+        timestamp: unix time the cycle was logged, as in fulllog.
+        ods, u, z: the values logged to fulllog for the cycle.
+        setpoint: setpoints in force, one per chamber.
+        excluded: chambers excluded at runtime.
+        blank_tx, blank_rx: the blank the ODs were computed against.
+        dispense_predicted: predicted seconds of the cycle's dispense plan.
+    """
+
+    __slots__ = ('cycle', 'timestamp', 'ods', 'u', 'z', 'setpoint',
+                 'excluded', 'blank_tx', 'blank_rx', 'dispense_predicted')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            value = fields.get(name)
+            if isinstance(value, list):
+                value = tuple(value)
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise TypeError('snapshots are read only')
+
+    def asDict(self):
+        return dict((name, list(getattr(self, name))
+                     if isinstance(getattr(self, name), tuple)
+                     else getattr(self, name))
+                    for name in self.__slots__)
+
+    def toJson(self):
+        return json.dumps(self.asDict())
+
+
+class SnapshotBoard(object):
+    """Publishes the latest snapshot and a bounded history of them.
+
+    There is a single writer (the control loop). Readers take .latest or
+    .history without any lock: each publish builds a new tuple and replaces
+    the attribute, which is atomic, so a reader always sees a complete,
+    consistent history however long the experiment has been running.
+    """
+
+    def __init__(self, maxlen=1440):
+        """Initialize the board.
+
+        Args:
+            maxlen: number of cycles kept in the history (1440 is one day
+                at a 60 s period).
+        """
+        self.maxlen = int(maxlen)
+        self.latest = None
+        self.history = ()
+
+    def publish(self, snapshot):
+        if self.maxlen > 1:
+            self.history = self.history[-(self.maxlen - 1):] + (snapshot,)
+        else:
+            self.history = (snapshot,)
+        self.latest = snapshot
+
+    def recent(self, n=None):
+        """The last n snapshots, oldest first (all of them if n is None)."""
+        history = self.history
+        if n is None:
+            return history
+        return history[-int(n):] if int(n) > 0 else ()